@@ -0,0 +1,100 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+"""
+Asynchronous batcher querying a remote encoder. A local stand-in server
+(random word vectors averaged over each sentence, with an artificial
+latency) is started in a background thread.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import sys
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+import numpy as np
+
+# Set PATHs
+PATH_TO_SENTEVAL = '../'
+PATH_TO_DATA = '../data'
+
+# import SentEval
+sys.path.insert(0, PATH_TO_SENTEVAL)
+import senteval
+
+HOST, PORT = '127.0.0.1', 8765
+LATENCY = 0.05  # seconds per request of the stand-in server
+DIM = 300
+LIMIT = 2**26  # maximum size of a message
+
+
+# Stand-in server : one JSON list of sentences per line, answers with the
+# JSON list of their embeddings
+def word_vector(word):
+    seed = int(hashlib.md5(word.encode('utf-8')).hexdigest()[:8], 16)
+    return np.random.RandomState(seed).randn(DIM)
+
+
+async def handle(reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            batch = json.loads(line.decode('utf-8'))
+            await asyncio.sleep(LATENCY)
+            embeddings = [np.mean([word_vector(w) for w in sent.split()] or
+                                  [np.zeros(DIM)], 0).tolist() for sent in batch]
+            writer.write(json.dumps(embeddings).encode('utf-8') + b'\n')
+            await writer.drain()
+    except ConnectionError:
+        # the client went away, e.g. a cancelled request
+        pass
+    writer.close()
+
+
+def start_server():
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(
+        asyncio.start_server(handle, HOST, PORT, limit=LIMIT))
+    thread = threading.Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+# SentEval batcher : one request per batch, up to params.max_concurrency
+# requests in flight
+async def batcher(params, batch):
+    batch = [' '.join(w.decode('utf-8') if isinstance(w, bytes) else w
+                      for w in sent) for sent in batch]
+    reader, writer = await asyncio.open_connection(HOST, PORT, limit=LIMIT)
+    writer.write(json.dumps(batch).encode('utf-8') + b'\n')
+    await writer.drain()
+    embeddings = json.loads((await reader.readline()).decode('utf-8'))
+    writer.close()
+    return np.array(embeddings)
+
+
+# Set params for SentEval
+params_senteval = {'task_path': PATH_TO_DATA, 'usepytorch': True, 'kfold': 5,
+                   'max_concurrency': 8}
+params_senteval['classifier'] = {'nhid': 0, 'optim': 'rmsprop', 'batch_size': 128,
+                                 'tenacity': 3, 'epoch_size': 2}
+
+# Set up logger
+logging.basicConfig(format='%(asctime)s : %(message)s', level=logging.DEBUG)
+
+if __name__ == "__main__":
+    start_server()
+    se = senteval.engine.SE(params_senteval, batcher)
+    transfer_tasks = ['STS12', 'STS13', 'STS14', 'STS15', 'STS16', 'MR', 'CR']
+    results = se.eval(transfer_tasks)
+    print(results)
@@ -8,3 +8,4 @@
 from __future__ import absolute_import
 
 from senteval.engine import SE
+from senteval.registry import register_task
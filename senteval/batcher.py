@@ -0,0 +1,146 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+'''
+Adapters for batchers which do not follow the batcher(params, batch) protocol
+'''
+from __future__ import absolute_import, division, unicode_literals
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from senteval import utils, profiling
+
+
+class StreamBatcher(object):
+    """
+    Streaming batcher : a generator function batcher(params, batches) which
+    consumes an iterator of batches and yields the embeddings of each batch.
+    Batches are prepared by params.collate(params, batch) (tokenization,
+    padding ..) in a background thread, params.prefetch batches ahead.
+    """
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    def collate(self, params, batch):
+        return params.collate(params, batch) if params.collate else batch
+
+    def __call__(self, params, batch):
+        for embeddings in self.batcher(params, iter([self.collate(params, batch)])):
+            return embeddings
+
+    def batch_encode(self, params, samples):
+        with profiling.phase('batcher'):
+            embeddings = self.encode(params, samples)
+        profiling.count('sentences', len(samples))
+        return embeddings
+
+    def encode(self, params, samples):
+        batches = list(utils.sorted_batches(params, samples))
+        inputs = (self.collate(params, batch) for _, batch in batches)
+        if params.prefetch:
+            inputs = utils.prefetch(inputs, params.prefetch)
+
+        # embeddings are written in place, in the order of samples
+        enc_input = utils.EmbeddingCollector(len(samples), params.memmap_dir)
+        nbatches = 0
+        for (idx, _), embeddings in zip(batches, self.batcher(params, inputs)):
+            assert len(embeddings) == len(idx), \
+                'batcher returned {0} embeddings for a batch of {1} sentences' \
+                .format(len(embeddings), len(idx))
+            enc_input.write(idx, embeddings)
+            nbatches += 1
+        assert nbatches == len(batches), \
+            'batcher yielded {0} batches out of {1}'.format(nbatches, len(batches))
+        logging.debug('Encoded {0} sentences in {1} batches'
+                      .format(len(samples), nbatches))
+        return enc_input.result()
+
+
+class AsyncBatcher(object):
+    """
+    Asynchronous batcher : a coroutine function batcher(params, batch), e.g.
+    querying a remote encoder. Up to params.max_concurrency batches are in
+    flight at the same time. The event loop is created on first use and kept
+    until close() (SE closes it at the end of se.eval).
+    """
+    def __init__(self, batcher):
+        self.batcher = batcher
+        self.loop = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # cancels the tasks left on the loop and releases its selector
+        if self.loop is None or self.loop.is_closed():
+            return
+
+        async def cancel():
+            pending = [task for task in asyncio.all_tasks()
+                       if task is not asyncio.current_task()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            await self.loop.shutdown_asyncgens()
+
+        self.run(cancel())
+        self.loop.close()
+
+    def run(self, coroutine):
+        # the loop is kept across calls so that the batcher can reuse its
+        # connections
+        if self.loop is None or self.loop.is_closed():
+            self.loop = asyncio.new_event_loop()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return self.loop.run_until_complete(coroutine)
+        # called from a running event loop (e.g. notebooks)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(self.loop.run_until_complete,
+                                   coroutine).result()
+
+    def __call__(self, params, batch):
+        return self.run(self.batcher(params, batch))
+
+    def batch_encode(self, params, samples):
+        with profiling.phase('batcher'):
+            embeddings = self.run(self.encode(params, samples))
+        profiling.count('sentences', len(samples))
+        return embeddings
+
+    async def encode(self, params, samples):
+        batches = utils.sorted_batches(params, samples)
+        enc_input = utils.EmbeddingCollector(len(samples), params.memmap_dir)
+
+        async def worker():
+            # workers share the iterator over batches
+            for idx, batch in batches:
+                embeddings = await self.batcher(params, batch)
+                assert len(embeddings) == len(idx), \
+                    'batcher returned {0} embeddings for a batch of {1} sentences' \
+                    .format(len(embeddings), len(idx))
+                enc_input.write(idx, embeddings)
+
+        # the first failure cancels the other workers, which would otherwise
+        # stay on self.loop and resume on the next call
+        workers = [asyncio.ensure_future(worker())
+                   for _ in range(params.max_concurrency)]
+        try:
+            done, _ = await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        for task in done:
+            task.result()
+        return enc_input.result()
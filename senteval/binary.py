@@ -15,6 +15,7 @@ import os
 import numpy as np
 import logging
 
+from senteval import utils
 from senteval.tools.validation import InnerKFoldClassifier
 
 
@@ -35,20 +36,21 @@ class BinaryClassifierEval(object):
             return [line.split() for line in f.read().splitlines()]
 
     def run(self, params, batcher):
-        enc_input = []
+        self.encode(params, batcher)
+        return self.evaluate(params)
+
+    def encode(self, params, batcher):
         # Sort to reduce padding
         sorted_corpus = sorted(zip(self.samples, self.labels),
                                key=lambda z: (len(z[0]), z[1]))
         sorted_samples = [x for (x, y) in sorted_corpus]
         sorted_labels = [y for (x, y) in sorted_corpus]
         logging.info('Generating sentence embeddings')
-        for ii in range(0, self.n_samples, params.batch_size):
-            batch = sorted_samples[ii:ii + params.batch_size]
-            embeddings = batcher(params, batch)
-            enc_input.append(embeddings)
-        enc_input = np.vstack(enc_input)
+        self.enc_input = utils.batch_encode(params, batcher, sorted_samples)
+        self.y = np.array(sorted_labels)
         logging.info('Generated sentence embeddings')
 
+    def evaluate(self, params):
         config = {'nclasses': 2,
                   'seed': self.seed,
                   'max_iter': params.max_iter,
@@ -57,17 +59,18 @@ class BinaryClassifierEval(object):
                   'nhid': params.nhid,
                   'kfold': params.kfold}
 
-        y = np.array(sorted_labels)
-
         # if params.usepytorch:
         #     enc_input = torch.from_numpy(enc_input).float()
         #     y = torch.LongTensor(sorted_labels)
 
-        clf = InnerKFoldClassifier(enc_input, y, config)
+        clf = InnerKFoldClassifier(self.enc_input, self.y, config)
         devacc, testacc = clf.run()
         logging.debug('Dev acc : {0} Test acc : {1}\n'.format(devacc, testacc))
-        return {'devacc': devacc, 'acc': testacc, 'ndev': self.n_samples,
-                'ntest': self.n_samples}
+        results = {'devacc': devacc, 'acc': testacc, 'ndev': self.n_samples,
+                   'ntest': self.n_samples}
+        if params.per_example:
+            results['correct'] = clf.correct
+        return results
 
 
 class CREval(BinaryClassifierEval):
@@ -0,0 +1,281 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+'''
+Sentence embedding caches : persistent on-disk cache and in-memory table
+shared across tasks
+'''
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import io
+import glob
+import time
+import uuid
+import hashlib
+import logging
+import numpy as np
+from contextlib import contextmanager
+
+from senteval import utils
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# age (seconds) after which shards missing from the index are considered left
+# by a job which died before writing the index
+STALE_AGE = 24 * 3600
+
+
+def sentence_key(sentence):
+    # sentences are lists of tokens (bytes for COCO), hash the length-prefixed
+    # tokens so that token lists never collide (e.g. ['a b'] and ['a', 'b'])
+    tokens = [w.decode('utf-8') if isinstance(w, bytes) else w for w in sentence]
+    return hashlib.sha1(''.join('{0}:{1}'.format(len(w), w) for w in tokens)
+                        .encode('utf-8')).digest()
+
+
+class EmbeddingCache(object):
+    """
+    Embeddings are stored in .npy shards under cache_dir/<encoder>/ and read
+    back through memory maps. Shards are evicted in least-recently-used order
+    once their total size exceeds max_bytes.
+    Processes can share a cache : shard names are unique to the process that
+    writes them, and the index is merged with the one on disk under a file
+    lock before it is written.
+    """
+    def __init__(self, cache_dir, encoder_id, max_bytes=10 * 2**30,
+                 shard_size=8192):
+        fingerprint = hashlib.sha1(str(encoder_id).encode('utf-8')).hexdigest()
+        self.path = os.path.join(cache_dir, fingerprint[:16])
+        self.max_bytes = max_bytes
+        self.shard_size = shard_size
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        self.index_path = os.path.join(self.path, 'index.pkl')
+        self.lock_path = os.path.join(self.path, 'index.lock')
+        self.prefix = 'shard-{0}-{1}-'.format(os.getpid(), uuid.uuid4().hex[:8])
+        self.next_shard = 0
+        self.entries = {}  # key -> (shard, row)
+        self.shards = {}  # shard -> {'keys', 'nbytes', 'atime'}
+        self.recent = set()  # shards written during the current lookup
+        self.mmaps = {}
+        self.pending_keys, self.pending = [], {}
+        self.hits, self.misses = 0, 0
+
+        with self.locked():
+            self.merge_index()
+            # remove the shards of jobs which died before writing the index
+            for fpath in glob.glob(os.path.join(self.path, 'shard-*')):
+                try:
+                    if self.shard_id(fpath) not in self.shards and \
+                            time.time() - os.path.getmtime(fpath) > STALE_AGE:
+                        os.remove(fpath)
+                except OSError:  # removed by another process
+                    pass
+        logging.info('Embedding cache at {0}: {1} sentences in {2} shards'
+                     .format(self.path, len(self.entries), len(self.shards)))
+
+    def shard_path(self, shard):
+        return os.path.join(self.path, shard + '.npy')
+
+    def shard_id(self, fpath):
+        return os.path.basename(fpath).split('.')[0]
+
+    @property
+    def nbytes(self):
+        return sum(s['nbytes'] for s in self.shards.values())
+
+    @contextmanager
+    def locked(self):
+        # exclusive lock of the index, shared by the processes using the cache
+        with io.open(self.lock_path, 'ab') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with io.open(self.index_path, 'rb') as f:
+            return pickle.load(f)['shards']
+
+    def merge_index(self):
+        # shards of the index on disk and of this process, without the shards
+        # evicted (deleted) by any process
+        shards = self.read_index()
+        for shard, info in self.shards.items():
+            if shard in shards:
+                info = dict(info, atime=max(info['atime'], shards[shard]['atime']))
+            shards[shard] = info
+        self.shards = {s: info for s, info in shards.items()
+                       if os.path.exists(self.shard_path(s))}
+        self.mmaps = {s: m for s, m in self.mmaps.items() if s in self.shards}
+        self.entries = {}
+        for shard, info in self.shards.items():
+            for row, key in enumerate(info['keys']):
+                self.entries.setdefault(key, (shard, row))
+
+    def get(self, key):
+        if key in self.pending:
+            return self.pending[key]
+        if key not in self.entries:
+            return None
+        shard, row = self.entries[key]
+        if shard not in self.mmaps:
+            try:
+                self.mmaps[shard] = np.load(self.shard_path(shard), mmap_mode='r')
+            except (IOError, OSError):  # evicted by another process
+                self.drop(shard)
+                return None
+        self.shards[shard]['atime'] = time.time()
+        return self.mmaps[shard][row]
+
+    def put(self, key, embedding):
+        if key in self.pending or key in self.entries:
+            return
+        self.pending_keys.append(key)
+        self.pending[key] = np.array(embedding)
+        if len(self.pending_keys) >= self.shard_size:
+            self.write_shard()
+
+    def write_shard(self):
+        if not self.pending_keys:
+            return
+        shard = self.prefix + '%06d' % self.next_shard
+        self.next_shard += 1
+        embeddings = np.vstack([self.pending[k] for k in self.pending_keys])
+        # readers never see a partially written shard
+        fpath = self.shard_path(shard)
+        with io.open(fpath + '.tmp', 'wb') as f:
+            np.save(f, embeddings)
+        os.rename(fpath + '.tmp', fpath)
+        self.shards[shard] = {'keys': self.pending_keys,
+                              'nbytes': embeddings.nbytes,
+                              'atime': time.time()}
+        for row, key in enumerate(self.pending_keys):
+            self.entries[key] = (shard, row)
+        self.pending_keys, self.pending = [], {}
+        self.recent.add(shard)
+        with self.locked():
+            self.evict(keep=self.recent)
+
+    def drop(self, shard):
+        for key in self.shards[shard]['keys']:
+            if self.entries.get(key, (None,))[0] == shard:
+                del self.entries[key]
+        del self.shards[shard]
+        self.mmaps.pop(shard, None)
+
+    def evict(self, keep=()):
+        # called with the lock held
+        nbytes = self.nbytes
+        for shard in sorted(self.shards, key=lambda s: self.shards[s]['atime']):
+            if nbytes <= self.max_bytes:
+                break
+            if shard in keep:
+                continue
+            nbytes -= self.shards[shard]['nbytes']
+            self.drop(shard)
+            try:
+                os.remove(self.shard_path(shard))
+            except OSError:  # evicted by another process
+                pass
+            logging.debug('Evicted embedding cache shard {0}'.format(shard))
+
+    def flush(self):
+        self.write_shard()
+        with self.locked():
+            self.merge_index()
+            self.evict(keep=self.recent)
+            with io.open(self.index_path + '.tmp', 'wb') as f:
+                pickle.dump({'shards': self.shards}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(self.index_path + '.tmp', self.index_path)
+        logging.info('Embedding cache: {0} hits, {1} misses, {2:.1f}MB on disk'
+                     .format(self.hits, self.misses, self.nbytes / 2**20))
+
+
+class CachedBatcher(object):
+    """
+    Wraps a batcher so that only sentences missing from the cache are encoded.
+    """
+    def __init__(self, batcher, cache):
+        self.batcher = batcher
+        self.cache = cache
+
+    def __call__(self, params, batch):
+        return self.lookup(params, batch, self.batcher)
+
+    def batch_encode(self, params, samples):
+        return self.lookup(params, samples, lambda params, x:
+                           utils.batch_encode(params, self.batcher, x))
+
+    def lookup(self, params, samples, encode):
+        keys = [sentence_key(s) for s in samples]
+        embeddings = [self.cache.get(k) for k in keys]
+        # encode each missing sentence once
+        missing = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(keys[i], i)
+        self.cache.hits += len(samples) - len(missing)
+        self.cache.misses += len(missing)
+        if missing:
+            encoded = encode(params, [samples[i] for i in missing.values()])
+            # shards written by this lookup are not evicted until it returns
+            self.cache.recent = set()
+            try:
+                for key, embedding in zip(missing, encoded):
+                    self.cache.put(key, embedding)
+            finally:
+                self.cache.recent = set()
+            rows = {key: j for j, key in enumerate(missing)}
+            embeddings = [encoded[rows[k]] if e is None else e
+                          for k, e in zip(keys, embeddings)]
+
+        enc_input = utils.EmbeddingCollector(len(samples), params.memmap_dir)
+        for i, embedding in enumerate(embeddings):
+            enc_input.write(i, embedding[None])
+        return enc_input.result()
+
+
+class EmbeddingTable(object):
+    """
+    Embeddings of a set of unique sentences, encoded once and then used as a
+    batcher that looks sentences up instead of encoding them.
+    """
+    def __init__(self, samples):
+        self.rows = {}
+        self.samples = []
+        for sample in samples:
+            key = sentence_key(sample)
+            if key not in self.rows:
+                self.rows[key] = len(self.samples)
+                self.samples.append(sample)
+        self.embeddings = None
+
+    def encode(self, params, batcher):
+        self.embeddings = utils.batch_encode(params, batcher, self.samples)
+
+    def __call__(self, params, batch):
+        return self.embeddings[[self.rows[sentence_key(s)] for s in batch]]
+
+    def batch_encode(self, params, samples):
+        return self(params, samples)
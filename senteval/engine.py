@@ -12,16 +12,82 @@ Generic sentence evaluation scripts wrapper
 '''
 from __future__ import absolute_import, division, unicode_literals
 
-from senteval import utils
-from senteval.binary import CREval, MREval, MPQAEval, SUBJEval
-from senteval.snli import SNLIEval
-from senteval.trec import TRECEval
-from senteval.sick import SICKRelatednessEval, SICKEntailmentEval
-from senteval.mrpc import MRPCEval
-from senteval.sts import STS12Eval, STS13Eval, STS14Eval, STS15Eval, STS16Eval, STSBenchmarkEval
-from senteval.sst import SSTEval
-from senteval.rank import ImageCaptionRetrievalEval
-from senteval.probing import *
+import inspect
+import logging
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from senteval import utils, registry, profiling
+from senteval.batcher import StreamBatcher, AsyncBatcher
+from senteval.cache import EmbeddingCache, CachedBatcher, EmbeddingTable
+
+# encoded tasks inherited by the workers of SE.evaluate_parallel
+_evaluations = None
+
+
+def wrap_batcher(batcher):
+    # generator and coroutine batchers are driven by StreamBatcher/AsyncBatcher
+    if inspect.isgeneratorfunction(batcher):
+        return StreamBatcher(batcher)
+    elif inspect.iscoroutinefunction(batcher):
+        return AsyncBatcher(batcher)
+    return batcher
+
+
+def close_batcher(batcher):
+    # event loop of an AsyncBatcher, possibly behind the embedding cache
+    if isinstance(batcher, CachedBatcher):
+        batcher = batcher.batcher
+    if isinstance(batcher, AsyncBatcher):
+        batcher.close()
+
+
+def paired_test(results_a, results_b, test, n_resamples, seed=1111):
+    """
+    Difference (a - b) of the main metric of a task and its two-sided
+    p-value, from the per-example outputs of both encoders : accuracy for
+    classification tasks (in percent, as in the results of the task),
+    Pearson correlation for SICK-R/STSB and mean Pearson correlation over
+    datasets for STS12-16. The difference and the resampled differences it
+    is tested against are in the same unit.
+    """
+    if 'correct' in results_a:
+        metric = 'acc'
+        correct_a, correct_b = results_a['correct'], results_b['correct']
+        deltas = 100 * utils.paired_accuracy_deltas(correct_a, correct_b, test,
+                                                    n_resamples, seed)
+        delta = observed = 100 * (np.mean(correct_a) - np.mean(correct_b))
+    elif 'gold' in results_a:
+        metric, delta = 'pearson', results_a['pearson'] - results_b['pearson']
+        deltas = utils.paired_correlation_deltas(
+            results_a['yhat'], results_b['yhat'], results_a['gold'], test,
+            n_resamples, seed)
+        observed = delta
+    elif 'all' in results_a:
+        metric = 'pearson'
+        delta = results_a['all']['pearson']['mean'] - results_b['all']['pearson']['mean']
+        datasets = [dset for dset in results_a if 'scores' in results_a[dset]]
+        deltas = np.mean([utils.paired_correlation_deltas(
+            results_a[dset]['scores'], results_b[dset]['scores'],
+            results_a[dset]['gold'], test, n_resamples, seed + k)
+            for k, dset in enumerate(datasets)], 0)
+        observed = delta
+    else:  # no per-example outputs (e.g. ImageCaptionRetrieval)
+        return {'metric': None, 'delta': None, 'pvalue': None}
+    return {'metric': metric, 'delta': delta,
+            'pvalue': utils.paired_pvalue(deltas, observed, test)}
+
+
+def evaluate_task(name):
+    evaluations, params = _evaluations
+    evaluation, profile = evaluations[name]
+    params.current_task = name
+    with profile.activate(), profiling.phase('evaluate'):
+        results = evaluation.evaluate(params)
+    results['profile'] = profile.to_dict()
+    return results
+
 
 class SE(object):
     def __init__(self, params, batcher, prepare=None):
@@ -32,6 +98,12 @@ class SE(object):
         params.device = 'cpu' if 'device' not in params else params.device
 
         params.batch_size = 128 if 'batch_size' not in params else params.batch_size
+        params.max_tokens = None if 'max_tokens' not in params else params.max_tokens
+        params.max_batch_size = None if 'max_batch_size' not in params else params.max_batch_size
+        params.memmap_dir = None if 'memmap_dir' not in params else params.memmap_dir
+        params.collate = None if 'collate' not in params else params.collate
+        params.prefetch = 2 if 'prefetch' not in params else params.prefetch
+        params.max_concurrency = 4 if 'max_concurrency' not in params else params.max_concurrency
         params.nhid = 0 if 'nhid' not in params else params.nhid
         params.kfold = 5 if 'kfold' not in params else params.kfold
 
@@ -40,85 +112,217 @@ class SE(object):
 
         assert 'nhid' in params.classifier, 'Set number of hidden units in classifier config!!'
 
+        # on-disk embedding cache
+        params.cache_dir = None if 'cache_dir' not in params else params.cache_dir
+        params.cache_size = 10 * 2**30 if 'cache_size' not in params else params.cache_size
+        if params.cache_dir is not None:
+            assert 'encoder_id' in params, 'Set encoder_id to identify the encoder in the embedding cache!!'
+        params.deduplicate = False if 'deduplicate' not in params else params.deduplicate
+        params.n_jobs = 1 if 'n_jobs' not in params else params.n_jobs
+        if params.n_jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            # the pool of evaluate_parallel forks the encoded tasks (not on Windows)
+            logging.warning('n_jobs = {0} needs the fork start method, which is not '
+                            'available on this platform : tasks are evaluated '
+                            'serially'.format(params.n_jobs))
+            params.n_jobs = 1
+        params.pipeline = False if 'pipeline' not in params else params.pipeline
+        params.pipeline_depth = 1 if 'pipeline_depth' not in params else params.pipeline_depth
+        params.trace_path = None if 'trace_path' not in params else params.trace_path
+        params.bootstrap = 0 if 'bootstrap' not in params else params.bootstrap
+        params.per_example = False if 'per_example' not in params else params.per_example
+
         self.params = params
 
         # batcher and prepare
+        batcher = wrap_batcher(batcher)
         self.batcher = batcher
         self.prepare = prepare if prepare else lambda x, y: None
+        self.cache = None
+        if params.cache_dir is not None:
+            self.cache = EmbeddingCache(params.cache_dir, params.encoder_id,
+                                        max_bytes=params.cache_size)
+            self.batcher = CachedBatcher(batcher, self.cache)
 
-        self.list_tasks = ['CR', 'MR', 'MPQA', 'SUBJ', 'SST2', 'SST5', 'TREC', 'MRPC',
-                           'SICKRelatedness', 'SICKEntailment', 'STSBenchmark',
-                           'SNLI', 'ImageCaptionRetrieval', 'STS12', 'STS13',
-                           'STS14', 'STS15', 'STS16',
-                           'Length', 'WordContent', 'Depth', 'TopConstituents',
-                           'BigramShift', 'Tense', 'SubjNumber', 'ObjNumber',
-                           'OddManOut', 'CoordinationInversion']
+    @property
+    def list_tasks(self):
+        return registry.list_tasks()
 
     def eval(self, name):
         # evaluate on evaluation [name], either takes string or list of strings
-        if (isinstance(name, list)):
-            self.results = {x: self.eval(x) for x in name}
-            return self.results
+        # the processes of parallel hyperparameter searches are shared by tasks
+        # (imported here, the classifiers are only imported with the tasks)
+        from senteval.tools.validation import search_pool
+        try:
+            with search_pool(self.params.classifier.get('n_jobs', 1)):
+                if (isinstance(name, list)):
+                    self.results = self.eval_tasks(name)
+                else:
+                    self.results = self.eval_tasks([name])[name]
+        finally:
+            close_batcher(self.batcher)
+        return self.results
 
-        tpath = self.params.task_path
-        assert name in self.list_tasks, str(name) + ' not in ' + str(self.list_tasks)
+    def eval_tasks(self, names):
+        batcher, prepare = self.batcher, self.prepare
+        evaluations, shared = {}, None
+        if self.params.deduplicate:
+            # tasks are loaded in their own profile, the shared encoding is
+            # recorded in a profile of its own
+            for name in names:
+                profile = profiling.Profile(name)
+                with profile.activate(), profiling.phase('load'):
+                    evaluations[name] = (self.load_task(name), profile)
+            shared = profiling.Profile('shared')
+            with shared.activate():
+                batcher = self.encode_shared([evaluation for evaluation, _
+                                              in evaluations.values()])
+            prepare = lambda params, x: None
 
-        # Original SentEval tasks
-        if name == 'CR':
-            self.evaluation = CREval(tpath + '/downstream/CR', seed=self.params.seed)
-        elif name == 'MR':
-            self.evaluation = MREval(tpath + '/downstream/MR', seed=self.params.seed)
-        elif name == 'MPQA':
-            self.evaluation = MPQAEval(tpath + '/downstream/MPQA', seed=self.params.seed)
-        elif name == 'SUBJ':
-            self.evaluation = SUBJEval(tpath + '/downstream/SUBJ', seed=self.params.seed)
-        elif name == 'SST2':
-            self.evaluation = SSTEval(tpath + '/downstream/SST/binary', nclasses=2, seed=self.params.seed)
-        elif name == 'SST5':
-            self.evaluation = SSTEval(tpath + '/downstream/SST/fine', nclasses=5, seed=self.params.seed)
-        elif name == 'TREC':
-            self.evaluation = TRECEval(tpath + '/downstream/TREC', seed=self.params.seed)
-        elif name == 'MRPC':
-            self.evaluation = MRPCEval(tpath + '/downstream/MRPC', seed=self.params.seed)
-        elif name == 'SICKRelatedness':
-            self.evaluation = SICKRelatednessEval(tpath + '/downstream/SICK', seed=self.params.seed)
-        elif name == 'STSBenchmark':
-            self.evaluation = STSBenchmarkEval(tpath + '/downstream/STS/STSBenchmark', seed=self.params.seed)
-        elif name == 'SICKEntailment':
-            self.evaluation = SICKEntailmentEval(tpath + '/downstream/SICK', seed=self.params.seed)
-        elif name == 'SNLI':
-            self.evaluation = SNLIEval(tpath + '/downstream/SNLI', seed=self.params.seed)
-        elif name in ['STS12', 'STS13', 'STS14', 'STS15', 'STS16']:
-            fpath = name + '-en-test'
-            self.evaluation = eval(name + 'Eval')(tpath + '/downstream/STS/' + fpath, seed=self.params.seed)
-        elif name == 'ImageCaptionRetrieval':
-            self.evaluation = ImageCaptionRetrievalEval(tpath + '/downstream/COCO', seed=self.params.seed)
-
-        # Probing Tasks
-        elif name == 'Length':
-                self.evaluation = LengthEval(tpath + '/probing', seed=self.params.seed)
-        elif name == 'WordContent':
-                self.evaluation = WordContentEval(tpath + '/probing', seed=self.params.seed)
-        elif name == 'Depth':
-                self.evaluation = DepthEval(tpath + '/probing', seed=self.params.seed)
-        elif name == 'TopConstituents':
-                self.evaluation = TopConstituentsEval(tpath + '/probing', seed=self.params.seed)
-        elif name == 'BigramShift':
-                self.evaluation = BigramShiftEval(tpath + '/probing', seed=self.params.seed)
-        elif name == 'Tense':
-                self.evaluation = TenseEval(tpath + '/probing', seed=self.params.seed)
-        elif name == 'SubjNumber':
-                self.evaluation = SubjNumberEval(tpath + '/probing', seed=self.params.seed)
-        elif name == 'ObjNumber':
-                self.evaluation = ObjNumberEval(tpath + '/probing', seed=self.params.seed)
-        elif name == 'OddManOut':
-                self.evaluation = OddManOutEval(tpath + '/probing', seed=self.params.seed)
-        elif name == 'CoordinationInversion':
-                self.evaluation = CoordinationInversionEval(tpath + '/probing', seed=self.params.seed)
-
-        self.params.current_task = name
-        self.evaluation.do_prepare(self.params, self.prepare)
-
-        self.results = self.evaluation.run(self.params, self.batcher)
+        tasks = self.encode_tasks(names, evaluations, batcher, prepare)
+        if self.params.pipeline:
+            # encode the next tasks while the classifier of the current one trains
+            tasks = utils.prefetch(tasks, self.params.pipeline_depth)
 
-        return self.results
+        results, encoded = {}, {}
+        for name, evaluation, profile, result in tasks:
+            self.evaluation = evaluation
+            if result is not None:
+                results[name] = result
+            elif self.params.n_jobs > 1:
+                # classifiers are trained in parallel once all tasks are encoded
+                encoded[name] = (evaluation, profile)
+                continue
+            else:
+                with profile.activate(), profiling.phase('evaluate'):
+                    results[name] = evaluation.evaluate(self.params)
+            results[name]['profile'] = profile.to_dict()
+            if self.params.pipeline:
+                # the encoded task is released before the next one is encoded
+                evaluation = self.evaluation = None
+
+        # all tasks are encoded, the workers do not inherit the event loop
+        close_batcher(self.batcher)
+        results.update(self.evaluate_parallel(encoded))
+        results = {name: results[name] for name in names}
+        if shared is not None:
+            shared = shared.to_dict()
+            for name in names:
+                results[name]['profile']['shared'] = shared
+        if self.params.trace_path is not None:
+            profiling.write_trace(self.params.trace_path, results)
+        return results
+
+    def compare(self, batcher_a, batcher_b, names, test='bootstrap',
+                n_resamples=1000):
+        """
+        Evaluate two encoders on the same tasks. Each task is loaded once and
+        both encoders are evaluated with the same folds and seeds, then the
+        difference of their main metric is tested on their per-example
+        outputs with a paired bootstrap or a permutation test. Returns per task
+        the results of both encoders and the difference (a - b) of the metric
+        with its p-value, see paired_test (accuracies in percent points).
+        The embedding cache is not used (it is specific to one encoder_id).
+        """
+        assert test in ['bootstrap', 'permutation'], 'Unknown test ' + str(test)
+        names = names if isinstance(names, list) else [names]
+        batchers = [wrap_batcher(batcher_a), wrap_batcher(batcher_b)]
+        per_example = self.params.per_example
+        self.params.per_example = True
+        comparison = {}
+        from senteval.tools.validation import search_pool
+        try:
+            with search_pool(self.params.classifier.get('n_jobs', 1)):
+                for name in names:
+                    evaluation = self.load_task(name)
+                    results = []
+                    for batcher in batchers:
+                        self.params.current_task = name
+                        evaluation.do_prepare(self.params, self.prepare)
+                        results.append(evaluation.run(self.params, batcher))
+                    comparison[name] = dict(paired_test(results[0], results[1], test,
+                                                        n_resamples, self.params.seed),
+                                            a=results[0], b=results[1], test=test)
+                    logging.info('{0} : {1} difference {2} with p-value {3}'
+                                 .format(name, comparison[name]['metric'],
+                                         comparison[name]['delta'],
+                                         comparison[name]['pvalue']))
+        finally:
+            self.params.per_example = per_example
+            for batcher in batchers:
+                close_batcher(batcher)
+        return comparison
+
+    def encode_tasks(self, names, evaluations, batcher, prepare):
+        # yields (name, evaluation, profile, results), results are None when
+        # the evaluation is encoded but its classifier remains to be trained
+        for name in names:
+            evaluation, profile = evaluations.pop(name, (None, profiling.Profile(name)))
+            with profile.activate():
+                if evaluation is None:
+                    with profiling.phase('load'):
+                        evaluation = self.load_task(name)
+                self.params.current_task = name
+                with profiling.phase('prepare'):
+                    evaluation.do_prepare(self.params, prepare)
+                if hasattr(evaluation, 'encode'):
+                    with profiling.phase('encode'):
+                        evaluation.encode(self.params, batcher)
+                        if self.cache is not None:
+                            self.cache.flush()
+                    result = None
+                else:
+                    with profiling.phase('run'):
+                        result = evaluation.run(self.params, batcher)
+                        if self.cache is not None:
+                            self.cache.flush()
+            yield name, evaluation, profile, result
+
+    def encode_shared(self, evaluations):
+        # encode the sentences shared by all tasks once, tasks are then
+        # evaluated on lookups into the shared embedding matrix
+        samples = []
+        with profiling.phase('prepare'):
+            for evaluation in evaluations:
+                evaluation.do_prepare(self.params,
+                                      lambda params, x: samples.extend(x))
+
+            table = EmbeddingTable(samples)
+            logging.info('Encoding {0} unique sentences out of {1} for {2} tasks'
+                         .format(len(table.samples), len(samples), len(evaluations)))
+            self.params.current_task = None
+            self.prepare(self.params, table.samples)
+        with profiling.phase('encode'):
+            table.encode(self.params, self.batcher)
+            if self.cache is not None:
+                self.cache.flush()
+        return table
+
+    def evaluate_parallel(self, evaluations):
+        # forked workers inherit the encoded tasks, only results are pickled
+        global _evaluations
+        if not evaluations:
+            return {}
+        n_jobs = min(self.params.n_jobs, len(evaluations))
+        nthreads = max(1, multiprocessing.cpu_count() // n_jobs)
+        logging.info('Training classifiers of {0} tasks with {1} processes'
+                     .format(len(evaluations), n_jobs))
+
+        _evaluations = (evaluations, self.params)
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     mp_context=multiprocessing.get_context('fork'),
+                                     initializer=utils.limit_threads,
+                                     initargs=(nthreads,)) as executor:
+                futures = {name: executor.submit(evaluate_task, name)
+                           for name in evaluations}
+                results = {name: future.result()
+                           for name, future in futures.items()}
+        finally:
+            _evaluations = None
+        return results
+
+    def load_task(self, name):
+        assert name in self.list_tasks, str(name) + ' not in ' + str(self.list_tasks)
+        self.evaluation = registry.get_task(name)(self.params.task_path,
+                                                  seed=self.params.seed)
+        return self.evaluation
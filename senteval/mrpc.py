@@ -15,6 +15,7 @@ import logging
 import numpy as np
 import io
 
+from senteval import utils
 from senteval.tools.validation import KFoldClassifier
 
 from sklearn.metrics import f1_score
@@ -52,6 +53,10 @@ class MRPCEval(object):
         return mrpc_data
 
     def run(self, params, batcher):
+        self.encode(params, batcher)
+        return self.evaluate(params)
+
+    def encode(self, params, batcher):
         mrpc_embed = {'train': {}, 'test': {}}
 
         for key in self.mrpc_data:
@@ -68,15 +73,14 @@ class MRPCEval(object):
             text_data['y'] = [z for (x, y, z) in sorted_corpus]
 
             for txt_type in ['A', 'B']:
-                mrpc_embed[key][txt_type] = []
-                for ii in range(0, len(text_data['y']), params.batch_size):
-                    batch = text_data[txt_type][ii:ii + params.batch_size]
-                    embeddings = batcher(params, batch)
-                    mrpc_embed[key][txt_type].append(embeddings)
-                mrpc_embed[key][txt_type] = np.vstack(mrpc_embed[key][txt_type])
+                mrpc_embed[key][txt_type] = utils.batch_encode(
+                    params, batcher, text_data[txt_type])
             mrpc_embed[key]['y'] = np.array(text_data['y'])
             logging.info('Computed {0} embeddings'.format(key))
+        self.mrpc_embed = mrpc_embed
 
+    def evaluate(self, params):
+        mrpc_embed = self.mrpc_embed
         # Train
         trainA = mrpc_embed['train']['A']
         trainB = mrpc_embed['train']['B']
@@ -100,5 +104,8 @@ class MRPCEval(object):
         testf1 = round(100*f1_score(testY, yhat), 2)
         logging.debug('Dev acc : {0} Test acc {1}; Test F1 {2} for MRPC.\n'
                       .format(devacc, testacc, testf1))
-        return {'devacc': devacc, 'acc': testacc, 'f1': testf1,
-                'ndev': len(trainA), 'ntest': len(testA)}
+        results = {'devacc': devacc, 'acc': testacc, 'f1': testf1,
+                   'ndev': len(trainA), 'ntest': len(testA)}
+        if params.per_example:
+            results['correct'] = clf.correct
+        return results
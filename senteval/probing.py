@@ -17,6 +17,7 @@ import copy
 import logging
 import numpy as np
 
+from senteval import utils
 from senteval.tools.validation import SplitClassifier
 
 
@@ -55,8 +56,11 @@ class PROBINGEval(object):
                 self.task_data[split]['y'][i] = self.tok2label[y]
 
     def run(self, params, batcher):
+        self.encode(params, batcher)
+        return self.evaluate(params)
+
+    def encode(self, params, batcher):
         task_embed = {'train': {}, 'dev': {}, 'test': {}}
-        bsize = params.batch_size
         logging.info('Computing embeddings for train/dev/test')
         for key in self.task_data:
             # Sort to reduce padding
@@ -65,15 +69,14 @@ class PROBINGEval(object):
                                  key=lambda z: (len(z[0]), z[1]))
             self.task_data[key]['X'], self.task_data[key]['y'] = map(list, zip(*sorted_data))
 
-            task_embed[key]['X'] = []
-            for ii in range(0, len(self.task_data[key]['y']), bsize):
-                batch = self.task_data[key]['X'][ii:ii + bsize]
-                embeddings = batcher(params, batch)
-                task_embed[key]['X'].append(embeddings)
-            task_embed[key]['X'] = np.vstack(task_embed[key]['X'])
+            task_embed[key]['X'] = utils.batch_encode(params, batcher,
+                                                      self.task_data[key]['X'])
             task_embed[key]['y'] = np.array(self.task_data[key]['y'])
         logging.info('Computed embeddings')
+        self.task_embed = task_embed
 
+    def evaluate(self, params):
+        task_embed = self.task_embed
         config_classifier = {'nclasses': self.nclasses, 'seed': self.seed,
                              'usepytorch': params.usepytorch,
                              'classifier': params.classifier}
@@ -94,9 +97,12 @@ class PROBINGEval(object):
         devacc, testacc = clf.run()
         logging.debug('\nDev acc : %.1f Test acc : %.1f for %s classification\n' % (devacc, testacc, self.task.upper()))
 
-        return {'devacc': devacc, 'acc': testacc,
-                'ndev': len(task_embed['dev']['X']),
-                'ntest': len(task_embed['test']['X'])}
+        results = {'devacc': devacc, 'acc': testacc,
+                   'ndev': len(task_embed['dev']['X']),
+                   'ntest': len(task_embed['test']['X'])}
+        if params.per_example:
+            results['correct'] = clf.correct
+        return results
 
 """
 Surface Information
@@ -0,0 +1,99 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+'''
+Per-task timings and throughput of the evaluation phases
+'''
+from __future__ import absolute_import, division, unicode_literals
+
+import io
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+_local = threading.local()
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on MacOS
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+class Profile(object):
+    """
+    Timings of the phases of a task : load, prepare, encode (of which batcher
+    calls) and evaluate (of which hyperparameter search, final fit, scoring),
+    plus counters of encoded sentences and classifier fits.
+    """
+    def __init__(self, task):
+        self.task = task
+        self.timings = {}
+        self.counts = {'sentences': 0, 'fits': 0}
+
+    @contextmanager
+    def activate(self):
+        # phases and counts of the current thread are recorded in this profile
+        previous = getattr(_local, 'profile', None)
+        _local.profile = self
+        try:
+            yield self
+        finally:
+            _local.profile = previous
+
+    def to_dict(self):
+        batcher_time = self.timings.get('batcher', 0)
+        return {'timings': {k: round(v, 4) for k, v in self.timings.items()},
+                'sentences': self.counts['sentences'],
+                'sentences_per_sec': round(self.counts['sentences'] / batcher_time, 1)
+                if batcher_time > 0 else None,
+                'fits': self.counts['fits'],
+                'peak_rss_mb': peak_rss_mb()}
+
+
+@contextmanager
+def phase(name):
+    profile = getattr(_local, 'profile', None)
+    start = time.time()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.timings[name] = profile.timings.get(name, 0) + time.time() - start
+
+
+def count(name, n=1):
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.counts[name] = profile.counts.get(name, 0) + n
+
+
+def write_trace(fpath, results):
+    # one JSON line per task, plus one for the encoding shared by the tasks
+    # (deduplicate)
+    records, shared = [], None
+    for task, result in results.items():
+        if 'profile' in result:
+            profile = dict(result['profile'])
+            shared = profile.pop('shared', shared)
+            records.append(dict(profile, task=task, time=time.time()))
+    if shared is not None:
+        records.append(dict(shared, task='shared', tasks=list(results),
+                            time=time.time()))
+    with io.open(fpath, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
@@ -20,6 +20,7 @@ try:
 except ImportError:
     import pickle
 
+from senteval import utils
 from senteval.tools.ranking import ImageSentenceRankingPytorch
 
 
@@ -66,27 +67,25 @@ class ImageCaptionRetrievalEval(object):
         return coco['train'], coco['valid'], coco['test']
 
     def run(self, params, batcher):
+        self.encode(params, batcher)
+        return self.evaluate(params)
+
+    def encode(self, params, batcher):
         coco_embed = {'train': {'sentfeat': [], 'imgfeat': []},
                       'dev': {'sentfeat': [], 'imgfeat': []},
                       'test': {'sentfeat': [], 'imgfeat': []}}
 
         for key in self.coco_data:
             logging.info('Computing embedding for {0}'.format(key))
-            # Sort to reduce padding
-            self.coco_data[key]['sent'] = np.array(self.coco_data[key]['sent'])
-            self.coco_data[key]['sent'], idx_sort = np.sort(self.coco_data[key]['sent']), np.argsort(self.coco_data[key]['sent'])
-            idx_unsort = np.argsort(idx_sort)
-
-            coco_embed[key]['X'] = []
-            nsent = len(self.coco_data[key]['sent'])
-            for ii in range(0, nsent, params.batch_size):
-                batch = self.coco_data[key]['sent'][ii:ii + params.batch_size]
-                embeddings = batcher(params, batch)
-                coco_embed[key]['sentfeat'].append(embeddings)
-            coco_embed[key]['sentfeat'] = np.vstack(coco_embed[key]['sentfeat'])[idx_unsort]
+            # batch_encode sorts by length to reduce padding
+            coco_embed[key]['sentfeat'] = utils.batch_encode(
+                params, batcher, self.coco_data[key]['sent'])
             coco_embed[key]['imgfeat'] = np.array(self.coco_data[key]['imgfeat'])
             logging.info('Computed {0} embeddings'.format(key))
+        self.coco_embed = coco_embed
 
+    def evaluate(self, params):
+        coco_embed = self.coco_embed
         config = {'seed': self.seed, 'projdim': 1000, 'margin': 0.2}
         clf = ImageSentenceRankingPytorch(train=coco_embed['train'],
                                           valid=coco_embed['dev'],
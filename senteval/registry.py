@@ -0,0 +1,84 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+'''
+Registry of the transfer tasks, task modules are only imported when a task
+is loaded
+'''
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import importlib
+
+
+_tasks = {}
+
+
+class LazyTask(object):
+    """
+    Task factory importing senteval.<module>.<classname> on first use.
+    """
+    def __init__(self, module, classname, path, **kwargs):
+        self.module = module
+        self.classname = classname
+        self.path = path
+        self.kwargs = kwargs
+
+    def __call__(self, task_path, seed=1111):
+        module = importlib.import_module('senteval.' + self.module)
+        evaluation = getattr(module, self.classname)
+        return evaluation(os.path.join(task_path, self.path), seed=seed,
+                          **self.kwargs)
+
+
+def register_task(name, factory):
+    """
+    Register a task under [name]. factory(task_path, seed) must return an
+    evaluation object with do_prepare(params, prepare) and run(params, batcher)
+    (and optionally encode(params, batcher) and evaluate(params)).
+    """
+    _tasks[name] = factory
+
+
+def get_task(name):
+    return _tasks[name]
+
+
+def list_tasks():
+    return list(_tasks)
+
+
+# Original SentEval tasks
+register_task('CR', LazyTask('binary', 'CREval', 'downstream/CR'))
+register_task('MR', LazyTask('binary', 'MREval', 'downstream/MR'))
+register_task('MPQA', LazyTask('binary', 'MPQAEval', 'downstream/MPQA'))
+register_task('SUBJ', LazyTask('binary', 'SUBJEval', 'downstream/SUBJ'))
+register_task('SST2', LazyTask('sst', 'SSTEval', 'downstream/SST/binary',
+                               nclasses=2))
+register_task('SST5', LazyTask('sst', 'SSTEval', 'downstream/SST/fine',
+                               nclasses=5))
+register_task('TREC', LazyTask('trec', 'TRECEval', 'downstream/TREC'))
+register_task('MRPC', LazyTask('mrpc', 'MRPCEval', 'downstream/MRPC'))
+register_task('SICKRelatedness', LazyTask('sick', 'SICKRelatednessEval',
+                                          'downstream/SICK'))
+register_task('SICKEntailment', LazyTask('sick', 'SICKEntailmentEval',
+                                         'downstream/SICK'))
+register_task('STSBenchmark', LazyTask('sts', 'STSBenchmarkEval',
+                                       'downstream/STS/STSBenchmark'))
+register_task('SNLI', LazyTask('snli', 'SNLIEval', 'downstream/SNLI'))
+register_task('ImageCaptionRetrieval', LazyTask('rank',
+                                                'ImageCaptionRetrievalEval',
+                                                'downstream/COCO'))
+for name in ['STS12', 'STS13', 'STS14', 'STS15', 'STS16']:
+    register_task(name, LazyTask('sts', name + 'Eval',
+                                 'downstream/STS/' + name + '-en-test'))
+
+# Probing Tasks
+for name in ['Length', 'WordContent', 'Depth', 'TopConstituents',
+             'BigramShift', 'Tense', 'SubjNumber', 'ObjNumber', 'OddManOut',
+             'CoordinationInversion']:
+    register_task(name, LazyTask('probing', name + 'Eval', 'probing'))
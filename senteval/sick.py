@@ -15,11 +15,12 @@ import io
 import logging
 import numpy as np
 
-from sklearn.metrics import mean_squared_error
 from scipy.stats import pearsonr, spearmanr
 
-from senteval.tools.relatedness import RelatednessPytorch
-from senteval.tools.validation import SplitClassifier
+from senteval import utils, profiling
+
+# classifiers (torch, sklearn) are imported when evaluating so that the
+# STS tasks, which subclass SICKRelatednessEval, do not depend on them
 
 
 class SICKRelatednessEval(object):
@@ -56,8 +57,11 @@ class SICKRelatednessEval(object):
         return sick_data
 
     def run(self, params, batcher):
+        self.encode(params, batcher)
+        return self.evaluate(params)
+
+    def encode(self, params, batcher):
         sick_embed = {'train': {}, 'dev': {}, 'test': {}}
-        bsize = params.batch_size
 
         for key in self.sick_data:
             logging.info('Computing embedding for {0}'.format(key))
@@ -72,15 +76,17 @@ class SICKRelatednessEval(object):
             self.sick_data[key]['y'] = [z for (x, y, z) in sorted_corpus]
 
             for txt_type in ['X_A', 'X_B']:
-                sick_embed[key][txt_type] = []
-                for ii in range(0, len(self.sick_data[key]['y']), bsize):
-                    batch = self.sick_data[key][txt_type][ii:ii + bsize]
-                    embeddings = batcher(params, batch)
-                    sick_embed[key][txt_type].append(embeddings)
-                sick_embed[key][txt_type] = np.vstack(sick_embed[key][txt_type])
+                sick_embed[key][txt_type] = utils.batch_encode(
+                    params, batcher, self.sick_data[key][txt_type])
             sick_embed[key]['y'] = np.array(self.sick_data[key]['y'])
             logging.info('Computed {0} embeddings'.format(key))
+        self.sick_embed = sick_embed
+
+    def evaluate(self, params):
+        from sklearn.metrics import mean_squared_error
+        from senteval.tools.relatedness import RelatednessPytorch
 
+        sick_embed = self.sick_embed
         # Train
         trainA = sick_embed['train']['X_A']
         trainB = sick_embed['train']['X_B']
@@ -99,7 +105,7 @@ class SICKRelatednessEval(object):
         testF = np.c_[np.abs(testA - testB), testA * testB]
         testY = self.encode_labels(self.sick_data['test']['y'])
 
-        config = {'seed': self.seed, 'nclasses': 5}
+        config = {'seed': self.seed, 'nclasses': 5, 'device': params.device}
         clf = RelatednessPytorch(train={'X': trainF, 'y': trainY},
                                  valid={'X': devF, 'y': devY},
                                  test={'X': testF, 'y': testY},
@@ -117,8 +123,17 @@ class SICKRelatednessEval(object):
         logging.debug('Test : Pearson {0} Spearman {1} MSE {2} \
                        for SICK Relatedness\n'.format(pr, sr, se))
 
-        return {'devpearson': devpr, 'pearson': pr, 'spearman': sr, 'mse': se,
-                'yhat': yhat, 'ndev': len(devA), 'ntest': len(testA)}
+        results = {'devpearson': devpr, 'pearson': pr, 'spearman': sr, 'mse': se,
+                   'yhat': yhat, 'ndev': len(devA), 'ntest': len(testA)}
+        if params.bootstrap:
+            with profiling.phase('bootstrap'):
+                pearsons, spearmans = utils.bootstrap_correlations(
+                    yhat, self.sick_data['test']['y'], params.bootstrap, params.seed)
+            results['pearson_ci'] = utils.confidence_interval(pearsons)
+            results['spearman_ci'] = utils.confidence_interval(spearmans)
+        if params.per_example:
+            results['gold'] = np.array(self.sick_data['test']['y'])
+        return results
 
     def encode_labels(self, labels, nclass=5):
         """
@@ -160,8 +175,11 @@ class SICKEntailmentEval(SICKRelatednessEval):
         return sick_data
 
     def run(self, params, batcher):
+        self.encode(params, batcher)
+        return self.evaluate(params)
+
+    def encode(self, params, batcher):
         sick_embed = {'train': {}, 'dev': {}, 'test': {}}
-        bsize = params.batch_size
 
         for key in self.sick_data:
             logging.info('Computing embedding for {0}'.format(key))
@@ -176,14 +194,15 @@ class SICKEntailmentEval(SICKRelatednessEval):
             self.sick_data[key]['y'] = [z for (x, y, z) in sorted_corpus]
 
             for txt_type in ['X_A', 'X_B']:
-                sick_embed[key][txt_type] = []
-                for ii in range(0, len(self.sick_data[key]['y']), bsize):
-                    batch = self.sick_data[key][txt_type][ii:ii + bsize]
-                    embeddings = batcher(params, batch)
-                    sick_embed[key][txt_type].append(embeddings)
-                sick_embed[key][txt_type] = np.vstack(sick_embed[key][txt_type])
+                sick_embed[key][txt_type] = utils.batch_encode(
+                    params, batcher, self.sick_data[key][txt_type])
             logging.info('Computed {0} embeddings'.format(key))
+        self.sick_embed = sick_embed
+
+    def evaluate(self, params):
+        from senteval.tools.validation import SplitClassifier
 
+        sick_embed = self.sick_embed
         # Train
         trainA = sick_embed['train']['X_A']
         trainB = sick_embed['train']['X_B']
@@ -213,5 +232,8 @@ class SICKEntailmentEval(SICKRelatednessEval):
         devacc, testacc = clf.run()
         logging.debug('\nDev acc : {0} Test acc : {1} for \
                        SICK entailment\n'.format(devacc, testacc))
-        return {'devacc': devacc, 'acc': testacc,
-                'ndev': len(devA), 'ntest': len(testA)}
+        results = {'devacc': devacc, 'acc': testacc,
+                   'ndev': len(devA), 'ntest': len(testA)}
+        if params.per_example:
+            results['correct'] = clf.correct
+        return results
@@ -16,6 +16,7 @@ import io
 import logging
 import numpy as np
 
+from senteval import utils
 from senteval.tools.validation import SplitClassifier
 
 
@@ -55,8 +56,11 @@ class SSTEval(object):
         return sst_data
 
     def run(self, params, batcher):
+        self.encode(params, batcher)
+        return self.evaluate(params)
+
+    def encode(self, params, batcher):
         sst_embed = {'train': {}, 'dev': {}, 'test': {}}
-        bsize = params.batch_size
 
         for key in self.sst_data:
             logging.info('Computing embedding for {0}'.format(key))
@@ -66,15 +70,14 @@ class SSTEval(object):
                                  key=lambda z: (len(z[0]), z[1]))
             self.sst_data[key]['X'], self.sst_data[key]['y'] = map(list, zip(*sorted_data))
 
-            sst_embed[key]['X'] = []
-            for ii in range(0, len(self.sst_data[key]['y']), bsize):
-                batch = self.sst_data[key]['X'][ii:ii + bsize]
-                embeddings = batcher(params, batch)
-                sst_embed[key]['X'].append(embeddings)
-            sst_embed[key]['X'] = np.vstack(sst_embed[key]['X'])
+            sst_embed[key]['X'] = utils.batch_encode(params, batcher,
+                                                     self.sst_data[key]['X'])
             sst_embed[key]['y'] = np.array(self.sst_data[key]['y'])
             logging.info('Computed {0} embeddings'.format(key))
+        self.sst_embed = sst_embed
 
+    def evaluate(self, params):
+        sst_embed = self.sst_embed
         config_classifier = {'nclasses': self.nclasses, 'seed': self.seed,
                              'usepytorch': params.usepytorch,
                              'classifier': params.classifier}
@@ -91,6 +94,9 @@ class SSTEval(object):
         logging.debug('\nDev acc : {0} Test acc : {1} for \
             SST {2} classification\n'.format(devacc, testacc, self.task_name))
 
-        return {'devacc': devacc, 'acc': testacc,
-                'ndev': len(sst_embed['dev']['X']),
-                'ntest': len(sst_embed['test']['X'])}
+        results = {'devacc': devacc, 'acc': testacc,
+                   'ndev': len(sst_embed['dev']['X']),
+                   'ntest': len(sst_embed['test']['X'])}
+        if params.per_example:
+            results['correct'] = clf.correct
+        return results
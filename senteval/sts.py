@@ -19,7 +19,8 @@ import logging
 
 from scipy.stats import spearmanr, pearsonr
 
-from senteval.utils import cosine
+from senteval import utils, profiling
+from senteval.cache import EmbeddingTable, sentence_key
 from senteval.sick import SICKRelatednessEval
 
 
@@ -49,33 +50,58 @@ class STSEval(object):
             self.samples += sent1 + sent2
 
     def do_prepare(self, params, prepare):
-        if 'similarity' in params:
+        # pairs are scored by batch_similarity, or one by one by a
+        # user-defined similarity
+        self.similarity, self.batch_similarity = None, None
+        if 'batch_similarity' not in params and 'similarity' in params:
             self.similarity = params.similarity
         else:  # Default similarity is cosine
-            self.similarity = lambda s1, s2: np.nan_to_num(cosine(np.nan_to_num(s1), np.nan_to_num(s2)))
+            self.batch_similarity = utils.get_batch_similarity(
+                params.get('batch_similarity', 'cosine'))
         return prepare(params, self.samples)
 
     def run(self, params, batcher):
-        results = {}
+        self.encode(params, batcher)
+        return self.evaluate(params)
+
+    def encode(self, params, batcher):
+        # sentences repeated across datasets and pair sides are encoded once,
+        # pair embeddings are then gathered from the table
+        table = EmbeddingTable(self.samples)
+        logging.debug('Encoding {0} unique sentences out of {1}'
+                      .format(len(table.samples), len(self.samples)))
+        table.encode(params, batcher)
+        self.sts_embed = {}
         for dataset in self.datasets:
-            sys_scores = []
             input1, input2, gs_scores = self.data[dataset]
-            for ii in range(0, len(gs_scores), params.batch_size):
-                batch1 = input1[ii:ii + params.batch_size]
-                batch2 = input2[ii:ii + params.batch_size]
-
-                # we assume get_batch already throws out the faulty ones
-                if len(batch1) == len(batch2) and len(batch1) > 0:
-                    enc1 = batcher(params, batch1)
-                    enc2 = batcher(params, batch2)
-
-                    for kk in range(enc2.shape[0]):
-                        sys_score = self.similarity(enc1[kk], enc2[kk])
-                        sys_scores.append(sys_score)
+            self.sts_embed[dataset] = tuple(
+                table.embeddings[[table.rows[sentence_key(s)] for s in sents]]
+                for sents in [input1, input2])
+
+    def evaluate(self, params):
+        results, bootstraps = {}, {}
+        for k, dataset in enumerate(self.datasets):
+            enc1, enc2 = self.sts_embed[dataset]
+            gs_scores = self.data[dataset][2]
+            with profiling.phase('score'):
+                if self.batch_similarity is not None:
+                    sys_scores = self.batch_similarity(enc1, enc2)
+                else:
+                    sys_scores = [self.similarity(enc1[kk], enc2[kk])
+                                  for kk in range(enc2.shape[0])]
 
             results[dataset] = {'pearson': pearsonr(sys_scores, gs_scores),
                                 'spearman': spearmanr(sys_scores, gs_scores),
                                 'nsamples': len(sys_scores)}
+            if params.per_example:
+                results[dataset]['scores'] = np.asarray(sys_scores)
+                results[dataset]['gold'] = np.asarray(gs_scores)
+            if params.bootstrap:
+                with profiling.phase('bootstrap'):
+                    bootstraps[dataset] = utils.bootstrap_correlations(
+                        sys_scores, gs_scores, params.bootstrap, params.seed + k)
+                results[dataset]['pearson_ci'] = utils.confidence_interval(bootstraps[dataset][0])
+                results[dataset]['spearman_ci'] = utils.confidence_interval(bootstraps[dataset][1])
             logging.debug('%s : pearson = %.4f, spearman = %.4f' %
                           (dataset, results[dataset]['pearson'][0],
                            results[dataset]['spearman'][0]))
@@ -95,6 +121,14 @@ class STSEval(object):
                                       'wmean': wavg_pearson},
                           'spearman': {'mean': avg_spearman,
                                        'wmean': wavg_spearman}}
+        if params.bootstrap:
+            # averages over datasets of each resample
+            for i, metric in enumerate(['pearson', 'spearman']):
+                samples = np.array([bootstraps[dset][i] for dset in self.datasets])
+                results['all'][metric]['mean_ci'] = utils.confidence_interval(
+                    np.average(samples, axis=0))
+                results['all'][metric]['wmean_ci'] = utils.confidence_interval(
+                    np.average(samples, axis=0, weights=weights))
         logging.debug('ALL (weighted average) : Pearson = %.4f, \
             Spearman = %.4f' % (wavg_pearson, wavg_spearman))
         logging.debug('ALL (average) : Pearson = %.4f, \
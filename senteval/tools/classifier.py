@@ -13,8 +13,7 @@ Classifiers include Logistic Regression and MLP
 from __future__ import absolute_import, division, unicode_literals
 
 import numpy as np
-import copy
-from senteval import utils
+from senteval import utils, profiling
 
 import torch
 from torch import nn
@@ -34,6 +33,16 @@ class PyTorchClassifier(object):
         self.l2reg = l2reg
         self.batch_size = batch_size
         self.device = torch.device(device)
+        self.cudaEfficient = False
+        self.batches = None
+
+    def to_device(self, *tensors):
+        # the training data is moved to the device once per fit, so that
+        # epochs are shuffled and gathered there. With cudaEfficient it stays
+        # on CPU and only minibatches are moved
+        if self.cudaEfficient:
+            return tensors
+        return tuple(t.to(self.device) for t in tensors)
 
     def prepare_split(self, X, y, validation_data=None, validation_split=None):
         # Preparing validation data
@@ -48,12 +57,7 @@ class PyTorchClassifier(object):
             trainX, trainy = X[trainidx], y[trainidx]
             devX, devy = X[devidx], y[devidx]
 
-        # trainX = torch.from_numpy(trainX).to(self.device, dtype=torch.float32)
-        # trainy = torch.from_numpy(trainy).to(self.device, dtype=torch.int64)
-        # devX = torch.from_numpy(devX).to(self.device, dtype=torch.float32)
-        # devy = torch.from_numpy(devy).to(self.device, dtype=torch.int64)
-
-        return trainX, trainy, devX, devy
+        return self.to_device(trainX, trainy, devX, devy)
 
     def fit(self, X, y, validation_data=None, validation_split=None,
             early_stop=True):
@@ -61,37 +65,42 @@ class PyTorchClassifier(object):
         bestaccuracy = -1
         stop_train = False
         early_stop_count = 0
+        profiling.count('fits')
 
         # Preparing validation data
         trainX, trainy, devX, devy = self.prepare_split(X, y, validation_data,
                                                         validation_split)
 
         # Training
+        bestmodel = utils.Checkpoint(self.model)
         while not stop_train and self.nepoch <= self.max_epoch:
             self.trainepoch(trainX, trainy, epoch_size=self.epoch_size)
             accuracy = self.score(devX, devy)
             if accuracy > bestaccuracy:
                 bestaccuracy = accuracy
-                bestmodel = copy.deepcopy(self.model)
+                bestmodel.save()
             elif early_stop:
                 if early_stop_count >= self.tenacity:
                     stop_train = True
                 early_stop_count += 1
-        self.model = bestmodel
+        bestmodel.restore()
+        self.batches = None
         return bestaccuracy
 
+    def epoch_batches(self, X, y):
+        # the buffers of the shuffled training set are reused across epochs
+        if self.batches is None or self.batches.tensors[0] is not X:
+            self.batches = utils.EpochIterator([X, y], self.batch_size,
+                                               device=self.device)
+        return self.batches
+
     def trainepoch(self, X, y, epoch_size=1):
         self.model.train()
+        batches = self.epoch_batches(X, y)
         for _ in range(self.nepoch, self.nepoch + epoch_size):
-            permutation = np.random.permutation(len(X))
             all_costs = []
-            for i in range(0, len(X), self.batch_size):
+            for _, Xbatch, ybatch in batches:
                 # forward
-                idx = torch.from_numpy(permutation[i:i + self.batch_size]).long().to(X.device)
-
-                Xbatch = X[idx].to(self.device)
-                ybatch = y[idx].to(self.device)
-
                 output = self.model(Xbatch)
                 # loss
                 loss = self.loss_fn(output, ybatch)
@@ -160,6 +169,7 @@ class MLP(PyTorchClassifier):
         -epoch_size: each epoch corresponds to epoch_size pass on the train set
         -max_epoch:  max number of epoches
         -dropout:    dropout for MLP
+        -cudaEfficient: keep the training set on CPU, move minibatches
         """
 
         self.nhid = 0 if "nhid" not in params else params["nhid"]
@@ -169,6 +179,7 @@ class MLP(PyTorchClassifier):
         self.max_epoch = 200 if "max_epoch" not in params else params["max_epoch"]
         self.dropout = 0. if "dropout" not in params else params["dropout"]
         self.batch_size = 64 if "batch_size" not in params else params["batch_size"]
+        self.cudaEfficient = False if "cudaEfficient" not in params else params["cudaEfficient"]
 
         if self.nhid == 0:
             self.model = nn.Sequential(
@@ -189,3 +200,259 @@ class MLP(PyTorchClassifier):
         optim_fn, optim_params = utils.get_optimizer(self.optim)
         self.optimizer = optim_fn(self.model.parameters(), **optim_params)
         self.optimizer.param_groups[0]['weight_decay'] = self.l2reg
+
+
+class StackedLinear(nn.Module):
+    """
+    Independent linear layers (one per member) applied to the same input
+    """
+
+    def __init__(self, linears):
+        super(StackedLinear, self).__init__()
+        self.weight = nn.Parameter(torch.stack([l.weight.data.t() for l in linears]))
+        self.bias = nn.Parameter(torch.stack([l.bias.data for l in linears]).unsqueeze(1))
+
+    def forward(self, x):
+        # (batch, in) or (members, batch, in) -> (members, batch, out)
+        return torch.matmul(x, self.weight) + self.bias
+
+
+class BatchedMLP(PyTorchClassifier):
+    """
+    One MLP per l2reg, stacked and trained together on the same minibatches.
+    Each member starts from the initialization of MLP with the same seed, has
+    its own weight decay and is early stopped on its own dev accuracy.
+    With folds, members are trained and scored on their own rows of X.
+    """
+
+    def __init__(self, params, inputdim, nclasses, l2regs, batch_size=64,
+                 seed=1111, device='cpu'):
+        super(BatchedMLP, self).__init__(inputdim, nclasses, 0., batch_size,
+                                         seed, device)
+        self.nhid = 0 if "nhid" not in params else params["nhid"]
+        self.optim = "adam" if "optim" not in params else params["optim"]
+        self.tenacity = 5 if "tenacity" not in params else params["tenacity"]
+        self.epoch_size = 4 if "epoch_size" not in params else params["epoch_size"]
+        self.max_epoch = 200 if "max_epoch" not in params else params["max_epoch"]
+        self.dropout = 0. if "dropout" not in params else params["dropout"]
+        self.batch_size = 64 if "batch_size" not in params else params["batch_size"]
+        self.cudaEfficient = False if "cudaEfficient" not in params else params["cudaEfficient"]
+        self.nmembers = len(l2regs)
+
+        linears = []
+        for _ in range(self.nmembers):
+            torch.manual_seed(seed)
+            if self.nhid == 0:
+                linears.append([nn.Linear(self.inputdim, self.nclasses)])
+            else:
+                linears.append([nn.Linear(self.inputdim, self.nhid),
+                                nn.Linear(self.nhid, self.nclasses)])
+        layers = [StackedLinear(l) for l in zip(*linears)]
+        if self.nhid == 0:
+            self.model = nn.Sequential(layers[0])
+        else:
+            self.model = nn.Sequential(
+                layers[0],
+                nn.Dropout(p=self.dropout),
+                nn.Sigmoid(),
+                layers[1],
+            )
+
+        self.model = self.model.to(self.device)
+        self.l2reg = torch.tensor(l2regs, dtype=torch.float32, device=self.device)
+
+        # weight decay is added to the gradients of each member in trainepoch
+        optim_fn, optim_params = utils.get_optimizer(self.optim)
+        self.optimizer = optim_fn(self.model.parameters(), **optim_params)
+
+    def fold_masks(self, folds, n):
+        # (members, n) masks of the train and dev rows of each member
+        train_mask = torch.zeros(self.nmembers, n, device=self.device)
+        dev_mask = torch.zeros(self.nmembers, n, device=self.device)
+        for i, (train_idx, dev_idx) in enumerate(folds):
+            train_mask[i, torch.from_numpy(np.asarray(train_idx)).long()] = 1
+            dev_mask[i, torch.from_numpy(np.asarray(dev_idx)).long()] = 1
+        return train_mask, dev_mask
+
+    def fit(self, X, y, validation_data=None, validation_split=None,
+            early_stop=True, folds=None):
+        """
+        folds: one (train_idx, dev_idx) split of X per member
+        """
+        self.nepoch = 0
+        bestaccuracy = np.full(self.nmembers, -1.)
+        stopped = np.zeros(self.nmembers, dtype=bool)
+        early_stop_count = np.zeros(self.nmembers, dtype=int)
+        profiling.count('fits')
+
+        # Preparing validation data
+        if folds is not None:
+            trainX, trainy = self.to_device(X, y)
+            devX, devy = trainX, trainy
+            train_mask, dev_mask = self.fold_masks(folds, len(X))
+        else:
+            trainX, trainy, devX, devy = self.prepare_split(X, y, validation_data,
+                                                            validation_split)
+            train_mask, dev_mask = None, None
+
+        # Training, stopped members keep training but are no longer scored
+        bestmodel = [p.detach().clone() for p in self.model.parameters()]
+        while not stopped.all() and self.nepoch <= self.max_epoch:
+            self.trainepoch(trainX, trainy, epoch_size=self.epoch_size,
+                            mask=train_mask)
+            accuracy = self.score(devX, devy, mask=dev_mask)
+            improved = (accuracy > bestaccuracy) & ~stopped
+            bestaccuracy[improved] = accuracy[improved]
+            if early_stop:
+                stalled = ~improved & ~stopped
+                stopped |= stalled & (early_stop_count >= self.tenacity)
+                early_stop_count += stalled
+            idx = torch.from_numpy(np.flatnonzero(improved)).to(self.device)
+            for best, p in zip(bestmodel, self.model.parameters()):
+                best[idx] = p.detach()[idx]
+        with torch.no_grad():
+            for best, p in zip(bestmodel, self.model.parameters()):
+                p.copy_(best)
+        self.batches = None
+        return bestaccuracy
+
+    def trainepoch(self, X, y, epoch_size=1, mask=None):
+        self.model.train()
+        batches = self.epoch_batches(X, y)
+        for _ in range(self.nepoch, self.nepoch + epoch_size):
+            for idx, Xbatch, ybatch in batches:
+                # forward
+                output = self.model(Xbatch)
+                # loss : sum of the mean losses of the members (over their
+                # own rows of the batch with a mask)
+                if mask is None:
+                    loss = F.cross_entropy(output.reshape(-1, self.nclasses),
+                                           ybatch.repeat(self.nmembers)) * self.nmembers
+                else:
+                    weight = mask[:, idx.to(self.device)]
+                    loss = F.cross_entropy(output.reshape(-1, self.nclasses),
+                                           ybatch.repeat(self.nmembers),
+                                           reduction='none').view(self.nmembers, -1)
+                    loss = ((loss * weight).sum(1) / weight.sum(1).clamp(min=1)).sum()
+                # backward
+                self.optimizer.zero_grad()
+                loss.backward()
+                for p in self.model.parameters():
+                    l2reg = self.l2reg.view(-1, *[1] * (p.dim() - 1))
+                    p.grad.add_(l2reg * p.detach())
+                # Update parameters
+                self.optimizer.step()
+        self.nepoch += epoch_size
+
+    def score(self, devX, devy, folds=None, mask=None):
+        # accuracy of each member, on its dev rows of devX with folds
+        if folds is not None:
+            _, mask = self.fold_masks(folds, len(devX))
+        self.model.eval()
+        correct = torch.zeros(self.nmembers, dtype=torch.int64, device=self.device)
+
+        with torch.no_grad():
+            for i in range(0, len(devX), self.batch_size):
+                Xbatch = devX[i:i + self.batch_size].to(self.device, dtype=torch.float32)
+                ybatch = devy[i:i + self.batch_size].to(self.device, dtype=torch.int64)
+                output = self.model(Xbatch)
+                pred = output.max(2)[1]
+                if mask is None:
+                    correct += pred.eq(ybatch).sum(1)
+                else:
+                    correct += (pred.eq(ybatch) & mask[:, i:i + self.batch_size].bool()).sum(1)
+        total = len(devX) if mask is None else mask.sum(1).cpu().numpy()
+        return correct.cpu().numpy() / total
+
+
+class RidgeClassifier(object):
+    """
+    One-vs-rest ridge regression on {-1, 1} targets, solved in closed form.
+    X^T X is diagonalized once in fit, the weights for each l2reg (relative
+    to the mean eigenvalue of X^T X) then cost O(d^2) in set_l2reg.
+    """
+
+    def __init__(self, nclasses, l2reg=1., device='cpu'):
+        self.nclasses = nclasses
+        self.l2reg = l2reg
+        self.device = torch.device(device)
+
+    def fit(self, X, y):
+        profiling.count('fits')
+        X = torch.as_tensor(X).to(self.device, dtype=torch.float32)
+        y = torch.as_tensor(y).to(self.device, dtype=torch.int64)
+        Y = -torch.ones(len(X), self.nclasses, device=self.device)
+        Y[torch.arange(len(X), device=self.device), y] = 1
+
+        # centering takes care of the intercept, products are accumulated
+        # in float32 and decomposed in float64
+        self.X_mean, self.Y_mean = X.mean(0), Y.mean(0)
+        X = X - self.X_mean
+        self.eigvals, self.eigvecs = torch.linalg.eigh((X.t() @ X).double())
+        self.eigvals = self.eigvals.clamp(min=0)
+        self.proj = self.eigvecs.t() @ (X.t() @ (Y - self.Y_mean)).double()
+        self.set_l2reg(self.l2reg)
+        return self
+
+    def set_l2reg(self, l2reg):
+        self.l2reg = l2reg
+        alpha = l2reg * self.eigvals.mean()
+        self.coef = (self.eigvecs @ (self.proj / (self.eigvals + alpha)[:, None])).float()
+        self.intercept = self.Y_mean - self.X_mean @ self.coef
+
+    def decision_function(self, X):
+        X = torch.as_tensor(X).to(self.device, dtype=torch.float32)
+        return X @ self.coef + self.intercept
+
+    def predict(self, X):
+        return self.decision_function(X).argmax(1).cpu().numpy()
+
+    def score(self, X, y):
+        return float(np.mean(self.predict(X) == np.asarray(y)))
+
+
+class LogRegLBFGS(PyTorchClassifier):
+    """
+    Multinomial logistic regression trained with full-batch L-BFGS until
+    convergence. fit starts from the current weights, so that successive fits
+    along a regularization path are warm-started.
+    """
+
+    def __init__(self, params, inputdim, nclasses, l2reg=0., batch_size=64,
+                 seed=1111, device='cpu'):
+        super(LogRegLBFGS, self).__init__(inputdim, nclasses, l2reg,
+                                          batch_size, seed, device)
+        """
+        PARAMETERS:
+        -max_iter:   max number of L-BFGS iterations
+        """
+        self.max_iter = 100 if "max_iter" not in params else params["max_iter"]
+        self.batch_size = 64 if "batch_size" not in params else params["batch_size"]
+
+        self.model = nn.Sequential(
+            nn.Linear(self.inputdim, self.nclasses),
+        ).to(self.device)
+        self.loss_fn = nn.CrossEntropyLoss().to(self.device)
+
+    def fit(self, X, y, validation_data=None, validation_split=None,
+            early_stop=True):
+        # no early stopping, validation data is not used
+        profiling.count('fits')
+        X = X.to(self.device, dtype=torch.float32)
+        y = y.to(self.device, dtype=torch.int64)
+        weight = self.model[0].weight
+        optimizer = torch.optim.LBFGS(self.model.parameters(), lr=1,
+                                      max_iter=self.max_iter,
+                                      tolerance_grad=1e-6,
+                                      tolerance_change=1e-9,
+                                      line_search_fn='strong_wolfe')
+
+        def closure():
+            optimizer.zero_grad()
+            loss = self.loss_fn(self.model(X), y) + \
+                0.5 * self.l2reg * weight.pow(2).sum()
+            loss.backward()
+            return loss
+
+        self.model.train()
+        return optimizer.step(closure).item()
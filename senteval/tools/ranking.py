@@ -11,7 +11,6 @@ Image Annotation/Search for COCO with Pytorch
 from __future__ import absolute_import, division, unicode_literals
 
 import logging
-import copy
 import numpy as np
 
 import torch
@@ -19,6 +18,8 @@ from torch import nn
 from torch.autograd import Variable
 import torch.optim as optim
 
+from senteval import utils, profiling
+
 
 class COCOProjNet(nn.Module):
     def __init__(self, config):
@@ -114,6 +115,7 @@ class ImageSentenceRankingPytorch(object):
         self.ncontrast = 30
         self.maxepoch = 20
         self.early_stop = True
+        self.batches = None
 
         config_model = {'imgdim': self.imgdim,'sentdim': self.sentdim,
                         'projdim': self.projdim}
@@ -139,6 +141,7 @@ class ImageSentenceRankingPytorch(object):
         bestdevscore = -1
         early_stop_count = 0
         stop_train = False
+        profiling.count('fits')
 
         # Preparing data
         logging.info('prepare data')
@@ -148,75 +151,78 @@ class ImageSentenceRankingPytorch(object):
                               self.test['sentfeat'], self.test['imgfeat'])
 
         # Training
-        while not stop_train and self.nepoch <= self.maxepoch:
-            logging.info('start epoch')
-            self.trainepoch(trainTxt, trainImg, devTxt, devImg, nepoches=1)
-            logging.info('Epoch {0} finished'.format(self.nepoch))
-
+        with profiling.phase('fit'):
+            bestmodel = utils.Checkpoint(self.model)
+            while not stop_train and self.nepoch <= self.maxepoch:
+                logging.info('start epoch')
+                self.trainepoch(trainTxt, trainImg, devTxt, devImg, nepoches=1)
+                logging.info('Epoch {0} finished'.format(self.nepoch))
+
+                results = {'i2t': {'r1': 0, 'r5': 0, 'r10': 0, 'medr': 0},
+                           't2i': {'r1': 0, 'r5': 0, 'r10': 0, 'medr': 0},
+                           'dev': bestdevscore}
+                score = 0
+                for i in range(5):
+                    devTxt_i = devTxt[i*5000:(i+1)*5000]
+                    devImg_i = devImg[i*5000:(i+1)*5000]
+                    # Compute dev ranks img2txt
+                    r1_i2t, r5_i2t, r10_i2t, medr_i2t = self.i2t(devImg_i,
+                                                                 devTxt_i)
+                    results['i2t']['r1'] += r1_i2t / 5
+                    results['i2t']['r5'] += r5_i2t / 5
+                    results['i2t']['r10'] += r10_i2t / 5
+                    results['i2t']['medr'] += medr_i2t / 5
+                    logging.info("Image to text: {0}, {1}, {2}, {3}"
+                                 .format(r1_i2t, r5_i2t, r10_i2t, medr_i2t))
+                    # Compute dev ranks txt2img
+                    r1_t2i, r5_t2i, r10_t2i, medr_t2i = self.t2i(devImg_i,
+                                                                 devTxt_i)
+                    results['t2i']['r1'] += r1_t2i / 5
+                    results['t2i']['r5'] += r5_t2i / 5
+                    results['t2i']['r10'] += r10_t2i / 5
+                    results['t2i']['medr'] += medr_t2i / 5
+                    logging.info("Text to Image: {0}, {1}, {2}, {3}"
+                                 .format(r1_t2i, r5_t2i, r10_t2i, medr_t2i))
+                    score += (r1_i2t + r5_i2t + r10_i2t +
+                              r1_t2i + r5_t2i + r10_t2i) / 5
+
+                logging.info("Dev mean Text to Image: {0}, {1}, {2}, {3}".format(
+                            results['t2i']['r1'], results['t2i']['r5'],
+                            results['t2i']['r10'], results['t2i']['medr']))
+                logging.info("Dev mean Image to text: {0}, {1}, {2}, {3}".format(
+                            results['i2t']['r1'], results['i2t']['r5'],
+                            results['i2t']['r10'], results['i2t']['medr']))
+
+                # early stop on Pearson
+                if score > bestdevscore:
+                    bestdevscore = score
+                    bestmodel.save()
+                elif self.early_stop:
+                    if early_stop_count >= 3:
+                        stop_train = True
+                    early_stop_count += 1
+            bestmodel.restore()
+
+        with profiling.phase('score'):
+            # Compute test for the 5 splits
             results = {'i2t': {'r1': 0, 'r5': 0, 'r10': 0, 'medr': 0},
                        't2i': {'r1': 0, 'r5': 0, 'r10': 0, 'medr': 0},
                        'dev': bestdevscore}
-            score = 0
             for i in range(5):
-                devTxt_i = devTxt[i*5000:(i+1)*5000]
-                devImg_i = devImg[i*5000:(i+1)*5000]
-                # Compute dev ranks img2txt
-                r1_i2t, r5_i2t, r10_i2t, medr_i2t = self.i2t(devImg_i,
-                                                             devTxt_i)
+                testTxt_i = testTxt[i*5000:(i+1)*5000]
+                testImg_i = testImg[i*5000:(i+1)*5000]
+                # Compute test ranks img2txt
+                r1_i2t, r5_i2t, r10_i2t, medr_i2t = self.i2t(testImg_i, testTxt_i)
                 results['i2t']['r1'] += r1_i2t / 5
                 results['i2t']['r5'] += r5_i2t / 5
                 results['i2t']['r10'] += r10_i2t / 5
                 results['i2t']['medr'] += medr_i2t / 5
-                logging.info("Image to text: {0}, {1}, {2}, {3}"
-                             .format(r1_i2t, r5_i2t, r10_i2t, medr_i2t))
-                # Compute dev ranks txt2img
-                r1_t2i, r5_t2i, r10_t2i, medr_t2i = self.t2i(devImg_i,
-                                                             devTxt_i)
+                # Compute test ranks txt2img
+                r1_t2i, r5_t2i, r10_t2i, medr_t2i = self.t2i(testImg_i, testTxt_i)
                 results['t2i']['r1'] += r1_t2i / 5
                 results['t2i']['r5'] += r5_t2i / 5
                 results['t2i']['r10'] += r10_t2i / 5
                 results['t2i']['medr'] += medr_t2i / 5
-                logging.info("Text to Image: {0}, {1}, {2}, {3}"
-                             .format(r1_t2i, r5_t2i, r10_t2i, medr_t2i))
-                score += (r1_i2t + r5_i2t + r10_i2t +
-                          r1_t2i + r5_t2i + r10_t2i) / 5
-
-            logging.info("Dev mean Text to Image: {0}, {1}, {2}, {3}".format(
-                        results['t2i']['r1'], results['t2i']['r5'],
-                        results['t2i']['r10'], results['t2i']['medr']))
-            logging.info("Dev mean Image to text: {0}, {1}, {2}, {3}".format(
-                        results['i2t']['r1'], results['i2t']['r5'],
-                        results['i2t']['r10'], results['i2t']['medr']))
-
-            # early stop on Pearson
-            if score > bestdevscore:
-                bestdevscore = score
-                bestmodel = copy.deepcopy(self.model)
-            elif self.early_stop:
-                if early_stop_count >= 3:
-                    stop_train = True
-                early_stop_count += 1
-        self.model = bestmodel
-
-        # Compute test for the 5 splits
-        results = {'i2t': {'r1': 0, 'r5': 0, 'r10': 0, 'medr': 0},
-                   't2i': {'r1': 0, 'r5': 0, 'r10': 0, 'medr': 0},
-                   'dev': bestdevscore}
-        for i in range(5):
-            testTxt_i = testTxt[i*5000:(i+1)*5000]
-            testImg_i = testImg[i*5000:(i+1)*5000]
-            # Compute test ranks img2txt
-            r1_i2t, r5_i2t, r10_i2t, medr_i2t = self.i2t(testImg_i, testTxt_i)
-            results['i2t']['r1'] += r1_i2t / 5
-            results['i2t']['r5'] += r5_i2t / 5
-            results['i2t']['r10'] += r10_i2t / 5
-            results['i2t']['medr'] += medr_i2t / 5
-            # Compute test ranks txt2img
-            r1_t2i, r5_t2i, r10_t2i, medr_t2i = self.t2i(testImg_i, testTxt_i)
-            results['t2i']['r1'] += r1_t2i / 5
-            results['t2i']['r5'] += r5_t2i / 5
-            results['t2i']['r10'] += r10_t2i / 5
-            results['t2i']['medr'] += medr_t2i / 5
 
         return bestdevscore, results['i2t']['r1'], results['i2t']['r5'], \
                              results['i2t']['r10'], results['i2t']['medr'], \
@@ -225,10 +231,14 @@ class ImageSentenceRankingPytorch(object):
 
     def trainepoch(self, trainTxt, trainImg, devTxt, devImg, nepoches=1):
         self.model.train()
+        # the buffers of the shuffled training set are reused across epochs
+        if self.batches is None or self.batches.tensors[0] is not trainTxt:
+            self.batches = utils.EpochIterator([trainTxt, trainImg],
+                                               self.batch_size)
         for _ in range(self.nepoch, self.nepoch + nepoches):
-            permutation = list(np.random.permutation(len(trainTxt)))
             all_costs = []
-            for i in range(0, len(trainTxt), self.batch_size):
+            for k, (idx, sentbatch, imgbatch) in enumerate(self.batches):
+                i = k * self.batch_size
                 # forward
                 if i % (self.batch_size*500) == 0 and i > 0:
                     logging.info('samples : {0}'.format(i))
@@ -241,22 +251,23 @@ class ImageSentenceRankingPytorch(object):
                                                                  devTxt)
                     logging.info("Text to Image: {0}, {1}, {2}, {3}".format(
                         r1_t2i, r5_t2i, r10_t2i, medr_t2i))
-                idx = torch.LongTensor(permutation[i:i + self.batch_size])
-                imgbatch = Variable(trainImg.index_select(0, idx)).cuda()
-                sentbatch = Variable(trainTxt.index_select(0, idx)).cuda()
-
-                idximgc = np.random.choice(permutation[:i] +
-                                           permutation[i + self.batch_size:],
-                                           self.ncontrast*idx.size(0))
-                idxsentc = np.random.choice(permutation[:i] +
-                                            permutation[i + self.batch_size:],
-                                            self.ncontrast*idx.size(0))
-                idximgc = torch.LongTensor(idximgc)
-                idxsentc = torch.LongTensor(idxsentc)
+                imgbatch = imgbatch.cuda()
+                sentbatch = sentbatch.cuda()
+
+                # contrastive images and sentences are sampled among the
+                # rows of the permutation outside of the batch
+                permutation = self.batches.permutation
+                ncontrast = self.ncontrast*idx.size(0)
+                idximgc = torch.randint(len(permutation) - idx.size(0), (ncontrast,))
+                idximgc += (idximgc >= i).long() * idx.size(0)
+                idxsentc = torch.randint(len(permutation) - idx.size(0), (ncontrast,))
+                idxsentc += (idxsentc >= i).long() * idx.size(0)
+                idximgc = permutation[idximgc]
+                idxsentc = permutation[idxsentc]
                 # Get indexes for contrastive images and sentences
-                imgcbatch = Variable(trainImg.index_select(0, idximgc)).view(
+                imgcbatch = trainImg.index_select(0, idximgc).view(
                     -1, self.ncontrast, self.imgdim).cuda()
-                sentcbatch = Variable(trainTxt.index_select(0, idxsentc)).view(
+                sentcbatch = trainTxt.index_select(0, idxsentc).view(
                     -1, self.ncontrast, self.sentdim).cuda()
 
                 anchor1, anchor2, img_sentc, sent_imgc = self.model(
@@ -10,7 +10,6 @@ Semantic Relatedness (supervised) with Pytorch
 """
 from __future__ import absolute_import, division, unicode_literals
 
-import copy
 import numpy as np
 
 import torch
@@ -19,14 +18,19 @@ import torch.optim as optim
 
 from scipy.stats import pearsonr
 
+from senteval import utils, profiling
+
 
 class RelatednessPytorch(object):
-    # Can be used for SICK-Relatedness, and STS14
+    """
+    Can be used for SICK-Relatedness, and STS14. The model is trained with
+    minibatch Adam, or on CPU by default with full-batch L-BFGS, and early
+    stopped on the Pearson correlation of its predictions on dev.
+    """
     def __init__(self, train, valid, test, devscores, config):
         # fix seed
         np.random.seed(config['seed'])
         torch.manual_seed(config['seed'])
-        assert torch.cuda.is_available(), 'torch.cuda required for Relatedness'
         torch.cuda.manual_seed(config['seed'])
 
         self.train = train
@@ -41,6 +45,12 @@ class RelatednessPytorch(object):
         self.batch_size = 64
         self.maxepoch = 1000
         self.early_stop = True
+        self.batches = None
+        self.device = torch.device('cpu' if 'device' not in config else config['device'])
+        self.full_batch = self.device.type == 'cpu' if 'full_batch' not in config \
+            else config['full_batch']
+        # L-BFGS iterations between two evaluations on dev, at most maxepoch
+        self.eval_iter = 10
 
         self.model = nn.Sequential(
             nn.Linear(self.inputdim, self.nclasses),
@@ -48,22 +58,25 @@ class RelatednessPytorch(object):
         )
         self.loss_fn = nn.MSELoss()
 
-        if torch.cuda.is_available():
-            self.model = self.model.cuda()
-            self.loss_fn = self.loss_fn.cuda()
+        self.model = self.model.to(self.device)
+        self.loss_fn = self.loss_fn.to(self.device)
 
-        self.loss_fn.size_average = False
-        self.optimizer = optim.Adam(self.model.parameters(),
-                                    weight_decay=self.l2reg)
+        if self.full_batch:
+            self.optimizer = optim.LBFGS(self.model.parameters(), lr=1,
+                                         max_iter=self.eval_iter,
+                                         line_search_fn='strong_wolfe')
+        else:
+            self.loss_fn.size_average = False
+            self.optimizer = optim.Adam(self.model.parameters(),
+                                        weight_decay=self.l2reg)
 
     def prepare_data(self, trainX, trainy, devX, devy, testX, testy):
-        # Transform probs to log-probs for KL-divergence
-        trainX = torch.from_numpy(trainX).float().cuda()
-        trainy = torch.from_numpy(trainy).float().cuda()
-        devX = torch.from_numpy(devX).float().cuda()
-        devy = torch.from_numpy(devy).float().cuda()
-        testX = torch.from_numpy(testX).float().cuda()
-        testY = torch.from_numpy(testy).float().cuda()
+        trainX = torch.from_numpy(trainX).to(self.device, dtype=torch.float32)
+        trainy = torch.from_numpy(trainy).to(self.device, dtype=torch.float32)
+        devX = torch.from_numpy(devX).to(self.device, dtype=torch.float32)
+        devy = torch.from_numpy(devy).to(self.device, dtype=torch.float32)
+        testX = torch.from_numpy(testX).to(self.device, dtype=torch.float32)
+        testy = torch.from_numpy(testy).to(self.device, dtype=torch.float32)
 
         return trainX, trainy, devX, devy, testX, testy
 
@@ -71,8 +84,8 @@ class RelatednessPytorch(object):
         self.nepoch = 0
         bestpr = -1
         early_stop_count = 0
-        r = np.arange(1, 6)
         stop_train = False
+        profiling.count('fits')
 
         # Preparing data
         trainX, trainy, devX, devy, testX, testy = self.prepare_data(
@@ -81,35 +94,40 @@ class RelatednessPytorch(object):
             self.test['X'], self.test['y'])
 
         # Training
-        while not stop_train and self.nepoch <= self.maxepoch:
-            self.trainepoch(trainX, trainy, nepoches=50)
-            yhat = np.dot(self.predict_proba(devX), r)
-            pr = pearsonr(yhat, self.devscores)[0]
-            pr = 0 if pr != pr else pr  # if NaN bc std=0
-            # early stop on Pearson
-            if pr > bestpr:
-                bestpr = pr
-                bestmodel = copy.deepcopy(self.model)
-            elif self.early_stop:
-                if early_stop_count >= 3:
-                    stop_train = True
-                early_stop_count += 1
-        self.model = bestmodel
-
-        yhat = np.dot(self.predict_proba(testX), r)
+        with profiling.phase('fit'):
+            bestmodel = utils.Checkpoint(self.model)
+            while not stop_train and self.nepoch <= self.maxepoch:
+                if self.full_batch:
+                    self.trainlbfgs(trainX, trainy)
+                else:
+                    self.trainepoch(trainX, trainy, nepoches=50)
+                yhat = self.predict(devX)
+                pr = pearsonr(yhat, self.devscores)[0]
+                pr = 0 if pr != pr else pr  # if NaN bc std=0
+                # early stop on Pearson
+                if pr > bestpr:
+                    bestpr = pr
+                    bestmodel.save()
+                elif self.early_stop:
+                    if early_stop_count >= 3:
+                        stop_train = True
+                    early_stop_count += 1
+            bestmodel.restore()
+
+        with profiling.phase('score'):
+            yhat = self.predict(testX)
 
         return bestpr, yhat
 
     def trainepoch(self, X, y, nepoches=1):
         self.model.train()
+        # the buffers of the shuffled training set are reused across epochs
+        if self.batches is None or self.batches.tensors[0] is not X:
+            self.batches = utils.EpochIterator([X, y], self.batch_size)
         for _ in range(self.nepoch, self.nepoch + nepoches):
-            permutation = np.random.permutation(len(X))
             all_costs = []
-            for i in range(0, len(X), self.batch_size):
+            for _, Xbatch, ybatch in self.batches:
                 # forward
-                idx = torch.from_numpy(permutation[i:i + self.batch_size]).long().cuda()
-                Xbatch = X[idx]
-                ybatch = y[idx]
                 output = self.model(Xbatch)
                 # loss
                 loss = self.loss_fn(output, ybatch)
@@ -121,14 +139,28 @@ class RelatednessPytorch(object):
                 self.optimizer.step()
         self.nepoch += nepoches
 
-    def predict_proba(self, devX):
+    def trainlbfgs(self, X, y):
+        # eval_iter full-batch L-BFGS iterations
+        self.model.train()
+
+        def closure():
+            self.optimizer.zero_grad()
+            loss = self.loss_fn(self.model(X), y)
+            loss.backward()
+            return loss
+        self.optimizer.step(closure)
+        self.nepoch += self.eval_iter
+
+    def predict_proba(self, devX, max_size=2**24):
+        # forward passes on chunks of at most max_size inputs
         self.model.eval()
-        probas = []
+        chunk = max(1, max_size // devX.shape[1])
         with torch.no_grad():
-            for i in range(0, len(devX), self.batch_size):
-                Xbatch = devX[i:i + self.batch_size]
-                if len(probas) == 0:
-                    probas = self.model(Xbatch).data.cpu().numpy()
-                else:
-                    probas = np.concatenate((probas, self.model(Xbatch).data.cpu().numpy()), axis=0)
+            probas = torch.cat([self.model(devX[i:i + chunk])
+                                for i in range(0, len(devX), chunk)])
         return probas
+
+    def predict(self, devX):
+        # expected score (1 to 5) under the predicted distribution
+        r = torch.arange(1, self.nclasses + 1, dtype=torch.float32, device=self.device)
+        return self.predict_proba(devX).matmul(r).cpu().numpy()
@@ -0,0 +1,98 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+"""
+Successive-halving search over the MLP hyperparameters
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import math
+import logging
+import itertools
+import numpy as np
+
+from senteval import profiling
+from senteval.tools.classifier import MLP
+
+
+def search_space(classifier_config, regs):
+    # values searched for each hyperparameter, l2reg defaults to the grid of
+    # the validation classifier and nhid includes the configured one
+    space = {'l2reg': regs,
+             'nhid': sorted(set([0, 50, 200, classifier_config['nhid']])),
+             'dropout': [0., 0.1, 0.25],
+             'optim': ['adam', 'rmsprop', 'sgd,lr=0.1']}
+    space.update(classifier_config.get('search_space', {}))
+    return space
+
+
+def candidates(classifier_config, regs):
+    # (classifier config, l2reg) pairs of the grid, dropout is only searched
+    # for MLPs with hidden units
+    space = search_space(classifier_config, regs)
+    grid = []
+    for nhid, dropout, optim, l2reg in itertools.product(
+            space['nhid'], space['dropout'], space['optim'], space['l2reg']):
+        params = dict(classifier_config, nhid=nhid, optim=optim,
+                      dropout=dropout if nhid > 0 else 0.)
+        if (params, l2reg) not in grid:
+            grid.append((params, l2reg))
+    return grid
+
+
+def halving_search(config, featdim, regs, splits, device='cpu'):
+    """
+    Successive halving : all candidates are trained for epoch_size epochs,
+    the better 1/eta of them (by dev accuracy averaged over splits) are
+    trained eta times longer, and so on until one is left or max_epoch is
+    reached. splits() iterates over (X_train, y_train, X_dev, y_dev).
+    Returns the classifier config, l2reg and dev accuracy of the best one.
+    """
+    classifier_config = config['classifier']
+    eta = classifier_config.get('halving_eta', 2)
+    epochs = 4 if 'epoch_size' not in classifier_config else classifier_config['epoch_size']
+    max_epoch = 200 if 'max_epoch' not in classifier_config else classifier_config['max_epoch']
+
+    grid = candidates(classifier_config, regs)
+    logging.info('Successive halving over {0} candidates'.format(len(grid)))
+    models = {}  # (candidate, split) -> MLP, kept across rounds
+    survivors = list(range(len(grid)))
+    while True:
+        scores = [[] for _ in grid]
+        for s, (X_train, y_train, X_dev, y_dev) in enumerate(splits()):
+            for c in survivors:
+                if (c, s) not in models:
+                    params, l2reg = grid[c]
+                    models[c, s] = MLP(params, inputdim=featdim,
+                                       nclasses=config['nclasses'], l2reg=l2reg,
+                                       seed=config['seed'], device=device)
+                    models[c, s].nepoch = 0
+                    profiling.count('fits')
+                clf = models[c, s]
+                clf.trainepoch(X_train, y_train, epoch_size=epochs - clf.nepoch)
+                clf.batches = None
+                scores[c].append(clf.score(X_dev, y_dev))
+        scores = {c: np.mean(scores[c]) for c in survivors}
+        logging.debug('Successive halving : {0} candidates at {1} epochs, best '
+                      'dev acc {2}'.format(len(survivors), epochs,
+                                           max(scores.values())))
+        if len(survivors) == 1 or epochs >= max_epoch:
+            break
+
+        # ties are broken by grid order
+        survivors = sorted(survivors, key=lambda c: -scores[c])
+        survivors = sorted(survivors[:int(math.ceil(len(survivors) / eta))])
+        models = {k: m for k, m in models.items() if k[0] in survivors}
+        epochs = min(epochs * eta, max_epoch)
+
+    best = max(survivors, key=lambda c: (scores[c], -c))
+    params, l2reg = grid[best]
+    logging.info('Successive halving : best candidate nhid = {0}, dropout = {1}, '
+                 'optim = {2}, l2reg = {3} with dev acc {4}'
+                 .format(params['nhid'], params['dropout'], params['optim'],
+                         l2reg, scores[best]))
+    return params, l2reg, scores[best]
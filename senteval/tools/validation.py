@@ -14,9 +14,19 @@ Validation and classification
 """
 from __future__ import absolute_import, division, unicode_literals
 
+import os
+import shutil
 import logging
+import tempfile
+import multiprocessing
 import numpy as np
-from senteval.tools.classifier import MLP
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+from senteval import utils, profiling
+from senteval.tools.classifier import MLP, BatchedMLP, RidgeClassifier, \
+    LogRegLBFGS
+from senteval.tools.search import halving_search
 
 import sklearn
 assert(sklearn.__version__ >= "0.18.0"), \
@@ -26,8 +36,38 @@ from sklearn.model_selection import StratifiedKFold
 import torch
 
 
+# l2reg of RidgeClassifier, relative to the mean eigenvalue of X^T X
+RIDGE_REGS = [10**t for t in range(-5, 2)]
+
+
+def get_backend(config):
+    # 'pytorch' (MLP), 'sklearn' (LogisticRegression), 'ridge' (RidgeClassifier)
+    # or 'lbfgs' (LogRegLBFGS)
+    default = 'pytorch' if config['usepytorch'] else 'sklearn'
+    return config['classifier'].get('backend', default)
+
+
+def test_correct(clf, X_test, y_test):
+    # per-example correctness of the test predictions, for paired tests
+    return np.asarray(clf.predict(X_test)).ravel() == np.asarray(y_test)
+
+
+def get_search(config):
+    # None (grid search over l2reg) or 'halving' (successive halving over
+    # l2reg, nhid, dropout and optim)
+    search = config['classifier'].get('search')
+    assert search in [None, 'halving'], 'Unknown search ' + str(search)
+    assert search is None or get_backend(config) == 'pytorch', \
+        'Successive halving is only available for the pytorch MLP'
+    return search
+
+
 def get_classif_name(classifier_config, usepytorch):
-    if not usepytorch:
+    if classifier_config.get('backend') == 'ridge':
+        modelname = 'closed-form-Ridge'
+    elif classifier_config.get('backend') == 'lbfgs':
+        modelname = 'pytorch-LogReg-lbfgs'
+    elif not usepytorch:
         modelname = 'sklearn-LogReg'
     else:
         nhid = classifier_config['nhid']
@@ -37,6 +77,267 @@ def get_classif_name(classifier_config, usepytorch):
     return modelname
 
 
+def as_tensors(config, X, y, device='cpu'):
+    """
+    float32 features and int64 labels, converted once per split so that
+    searches and final fits index the same tensors. Features are pinned when
+    fits run on a GPU. sklearn gets numpy arrays.
+    """
+    if get_backend(config) == 'sklearn' or torch.is_tensor(X):
+        return X, y
+    X = torch.from_numpy(np.asarray(X, dtype=np.float32))
+    y = torch.from_numpy(np.asarray(y, dtype=np.int64))
+    if torch.device(device).type == 'cuda':
+        X = X.pin_memory()
+    return X, y
+
+
+def pytorch_classifier(config, featdim, l2reg, device='cpu'):
+    if get_backend(config) == 'lbfgs':
+        return LogRegLBFGS(config['classifier'], inputdim=featdim,
+                           nclasses=config['nclasses'], l2reg=l2reg,
+                           seed=config['seed'], device=device)
+    return MLP(config['classifier'], inputdim=featdim,
+               nclasses=config['nclasses'], l2reg=l2reg,
+               seed=config['seed'], device=device)
+
+
+def fold_splits(X, y, folds):
+    # (X_train, y_train, X_dev, y_dev) of each (train_idx, dev_idx) fold
+    for train_idx, dev_idx in folds:
+        yield X[train_idx], y[train_idx], X[dev_idx], y[dev_idx]
+
+
+def score_regs(config, featdim, regs, X_train, y_train, X_dev, y_dev,
+               device='cpu'):
+    """
+    Dev accuracy of the classifier trained with each value of regs, in a
+    single batched fit when config['classifier']['batch_regs'] is set.
+    """
+    classifier_config = config['classifier']
+    if get_backend(config) == 'ridge':
+        # one decomposition for all regs
+        clf = RidgeClassifier(config['nclasses'], device=device)
+        clf.fit(X_train, y_train)
+        scores = []
+        for reg in regs:
+            clf.set_l2reg(reg)
+            scores.append(clf.score(X_dev, y_dev))
+        return np.array(scores)
+
+    if get_backend(config) == 'sklearn':
+        scores = []
+        for reg in regs:
+            clf = LogisticRegression(C=reg, random_state=config['seed'])
+            clf.fit(X_train, y_train)
+            profiling.count('fits')
+            scores.append(clf.score(X_dev, y_dev))
+        return np.array(scores)
+
+    X_train, y_train = as_tensors(config, X_train, y_train, device)
+    X_dev, y_dev = as_tensors(config, X_dev, y_dev, device)
+    if get_backend(config) == 'lbfgs':
+        # warm starts from the strongest regularization
+        clf = pytorch_classifier(config, featdim, max(regs), device=device)
+        scores = {}
+        for reg in sorted(regs, reverse=True):
+            clf.l2reg = reg
+            clf.fit(X_train, y_train)
+            scores[reg] = clf.score(X_dev, y_dev)
+        return np.array([scores[reg] for reg in regs])
+
+    if classifier_config.get('batch_regs', False):
+        clf = BatchedMLP(classifier_config, inputdim=featdim,
+                         nclasses=config['nclasses'], l2regs=regs,
+                         seed=config['seed'], device=device)
+        clf.fit(X_train, y_train, validation_data=(X_dev, y_dev))
+        return clf.score(X_dev, y_dev)
+
+    if classifier_config.get('warm_start', False):
+        path = warm_path(config, featdim, regs, X_train, y_train, device,
+                         validation_data=(X_dev, y_dev))
+        scores = {reg: clf.score(X_dev, y_dev) for reg, clf in path}
+        return np.array([scores[reg] for reg in regs])
+
+    scores = []
+    for reg in regs:
+        clf = pytorch_classifier(config, featdim, reg, device=device)
+        clf.fit(X_train, y_train, validation_data=(X_dev, y_dev))
+        scores.append(clf.score(X_dev, y_dev))
+    return np.array(scores)
+
+
+def warm_path(config, featdim, regs, X_train, y_train, device='cpu', **fit_args):
+    # MLPs fitted from the strongest to the weakest value of regs, each one
+    # starting from the weights of the previous one
+    previous = None
+    for reg in sorted(regs, reverse=True):
+        clf = pytorch_classifier(config, featdim, reg, device=device)
+        if previous is not None:
+            clf.model.load_state_dict(previous.model.state_dict())
+        clf.fit(X_train, y_train, **fit_args)
+        yield reg, clf
+        previous = clf
+
+
+def warm_started(config, folds=False):
+    # whether the l2reg search of the MLP (of score_folds with folds) fitted
+    # the regs along a warm-started path
+    classifier_config = config['classifier']
+    return get_backend(config) == 'pytorch' and get_search(config) is None and \
+        classifier_config.get('warm_start', False) and \
+        not classifier_config.get('batch_regs', False) and \
+        not (folds and classifier_config.get('batch_folds', False))
+
+
+def fit_final(config, featdim, regs, optreg, X_train, y_train, device='cpu',
+              folds=False, **fit_args):
+    """
+    Final pytorch classifier with l2reg optreg. When the search was
+    warm-started, it is fitted along the same path, from the strongest value
+    of regs down to optreg, so that it is trained as the model selected on dev.
+    """
+    if warm_started(config, folds):
+        for _, clf in warm_path(config, featdim, [reg for reg in regs if reg >= optreg],
+                                X_train, y_train, device, **fit_args):
+            pass
+        return clf
+    clf = pytorch_classifier(config, featdim, optreg, device=device)
+    clf.fit(X_train, y_train, **fit_args)
+    return clf
+
+
+def score_folds(config, featdim, regs, X, y, folds):
+    """
+    Dev accuracies (folds x regs) of the classifiers trained on each
+    (train_idx, dev_idx) fold of X with each value of regs, in a single
+    batched fit when config['classifier']['batch_folds'] is set.
+    """
+    folds = list(folds)
+    if get_backend(config) == 'pytorch' and config['classifier'].get('batch_folds', False):
+        members = [(fold, reg) for fold in folds for reg in regs]
+        clf = BatchedMLP(config['classifier'], inputdim=featdim,
+                         nclasses=config['nclasses'],
+                         l2regs=[reg for _, reg in members], seed=config['seed'])
+        X, y = as_tensors(config, X, y)
+        clf.fit(X, y, folds=[fold for fold, _ in members])
+        scores = clf.score(X, y, folds=[fold for fold, _ in members])
+        return scores.reshape(len(folds), len(regs))
+
+    n_jobs = config['classifier'].get('n_jobs', 1)
+    if n_jobs > 1:
+        return score_folds_parallel(config, featdim, regs, X, y, folds, n_jobs)
+
+    X, y = as_tensors(config, X, y)
+    return np.array([score_regs(config, featdim, regs, X[train_idx], y[train_idx],
+                                X[dev_idx], y[dev_idx])
+                     for train_idx, dev_idx in folds])
+
+
+# pool of score_folds_parallel, kept open by search_pool
+_pool = None
+
+
+class SearchPool(object):
+    """
+    Spawned processes running the jobs of score_folds_parallel. They are
+    started on first use and kept until close(), so that the cost of spawning
+    them (each one imports the __main__ module) is paid once.
+    """
+    def __init__(self, n_jobs):
+        self.n_jobs = n_jobs
+        self.pid = os.getpid()
+        self.executor = None
+
+    def submit(self, fn, *args):
+        if self.executor is None:
+            nthreads = max(1, multiprocessing.cpu_count() // self.n_jobs)
+            logging.info('Starting {0} processes for hyperparameter searches'
+                         .format(self.n_jobs))
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.n_jobs,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=utils.limit_threads, initargs=(nthreads,))
+        return self.executor.submit(fn, *args)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+@contextmanager
+def search_pool(n_jobs):
+    # calls of score_folds_parallel within the block share a pool of n_jobs
+    # processes
+    global _pool
+    previous, _pool = _pool, SearchPool(n_jobs)
+    try:
+        yield _pool
+    finally:
+        _pool.close()
+        _pool = previous
+
+
+def search_job(tmpdir, config, featdim, train_idx, dev_idx, regs):
+    # features are memory-mapped, labels are small
+    X = np.load(os.path.join(tmpdir, 'X.npy'), mmap_mode='r')
+    y = np.load(os.path.join(tmpdir, 'y.npy'))
+    profile = profiling.Profile(None)
+    with profile.activate():
+        scores = score_regs(config, featdim, regs, X[train_idx], y[train_idx],
+                            X[dev_idx], y[dev_idx])
+    return scores, profile.counts['fits']
+
+
+def score_folds_parallel(config, featdim, regs, X, y, folds, n_jobs):
+    """
+    score_folds in n_jobs processes. X is written once to a temporary .npy
+    file which the workers memory-map. Each fit is seeded with config['seed']
+    as in serial mode, so that results are the same. The processes of the
+    enclosing search_pool are used, or started for this call only.
+    """
+    if _pool is None or _pool.pid != os.getpid() or _pool.n_jobs != n_jobs:
+        # outside of search_pool, or in a process forked by SE.eval
+        with search_pool(n_jobs):
+            return score_folds_parallel(config, featdim, regs, X, y, folds, n_jobs)
+
+    # regs are fitted together (batched, warm-started or along a closed-form
+    # path) or as separate jobs
+    classifier_config = config['classifier']
+    if get_backend(config) in ['ridge', 'lbfgs'] or \
+            classifier_config.get('batch_regs', False) or \
+            classifier_config.get('warm_start', False):
+        jobs = [(i, list(range(len(regs)))) for i in range(len(folds))]
+    else:
+        jobs = [(i, [j]) for i in range(len(folds)) for j in range(len(regs))]
+    logging.info('Hyperparameter search : {0} jobs in {1} processes'
+                 .format(len(jobs), n_jobs))
+
+    if torch.is_tensor(X):
+        X, y = X.numpy(), y.numpy()
+    scores = np.zeros((len(folds), len(regs)))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        np.save(os.path.join(tmpdir, 'X.npy'), X)
+        np.save(os.path.join(tmpdir, 'y.npy'), y)
+        futures = [_pool.submit(search_job, tmpdir, config, featdim,
+                                folds[i][0], folds[i][1], [regs[j] for j in js])
+                   for i, js in jobs]
+        try:
+            for (i, js), future in zip(jobs, futures):
+                jobscores, fits = future.result()
+                scores[i, js] = jobscores
+                profiling.count('fits', fits)
+        finally:
+            # the pool outlives this call, jobs left after a failure are dropped
+            for future in futures:
+                future.cancel()
+    finally:
+        shutil.rmtree(tmpdir)
+    return scores
+
+
 # Pytorch version
 class InnerKFoldClassifier(object):
     """
@@ -51,9 +352,13 @@ class InnerKFoldClassifier(object):
         self.max_iter = config['max_iter']
         self.devresults = []
         self.testresults = []
+        self.correct = []
         self.usepytorch = config['usepytorch']
         self.classifier_config = config['classifier']
         self.modelname = get_classif_name(self.classifier_config, self.usepytorch)
+        self.backend = get_backend(config)
+        self.search = get_search(config)
+        self.config = config
 
         self.k = 5 if 'kfold' not in config else config['kfold']
 
@@ -61,58 +366,70 @@ class InnerKFoldClassifier(object):
         logging.info('Training {0} with (inner) {1}-fold cross-validation'
                      .format(self.modelname, self.k))
 
-        regs = [10**t for t in range(-5, -1)] if self.usepytorch else \
+        regs = [10**t for t in range(-5, -1)] if self.backend != 'sklearn' else \
                [2**t for t in range(-2, 4, 1)]
+        if self.backend == 'ridge':
+            regs = RIDGE_REGS
         skf = StratifiedKFold(n_splits=self.k, shuffle=True, random_state=1111)
         innerskf = StratifiedKFold(n_splits=self.k, shuffle=True,
                                    random_state=1111)
+        splits = list(skf.split(self.X, self.y))
+        X, y = as_tensors(self.config, self.X, self.y)
+        # inner folds of all outer splits, as indices of rows of X
+        innerfolds = [(train_idx[inner_train_idx], train_idx[inner_test_idx])
+                      for train_idx, _ in splits
+                      for inner_train_idx, inner_test_idx in
+                      innerskf.split(np.zeros(len(train_idx)), self.y[train_idx])]
+        with profiling.phase('search'):
+            if self.search == 'halving':
+                # one search per outer split, on its inner folds
+                searches = []
+                for i in range(len(splits)):
+                    folds = innerfolds[i * self.k:(i + 1) * self.k]
+                    params, optreg, score = halving_search(
+                        self.config, self.featdim, regs,
+                        lambda: fold_splits(X, y, folds))
+                    searches.append((params, optreg, round(100*score, 2)))
+            else:
+                innerscores = score_folds(self.config, self.featdim, regs,
+                                          X, y, innerfolds)
+                innerscores = innerscores.reshape(len(splits), -1, len(regs)).mean(1)
+                searches = []
+                for scores in innerscores:
+                    scores = [round(100*score, 2) for score in scores]
+                    searches.append((self.classifier_config,
+                                     regs[np.argmax(scores)], np.max(scores)))
+
         count = 0
-        for train_idx, test_idx in skf.split(self.X, self.y):
+        for (train_idx, test_idx), (params, optreg, devscore) in zip(splits, searches):
             count += 1
-            X_train, X_test = self.X[train_idx], self.X[test_idx]
-            y_train, y_test = self.y[train_idx], self.y[test_idx]
-            scores = []
-            for reg in regs:
-                regscores = []
-                for inner_train_idx, inner_test_idx in innerskf.split(X_train, y_train):
-                    X_in_train, X_in_test = X_train[inner_train_idx], X_train[inner_test_idx]
-                    y_in_train, y_in_test = y_train[inner_train_idx], y_train[inner_test_idx]
-                    if self.usepytorch:
-                        X_in_train, X_in_test = torch.from_numpy(X_in_train).float(), torch.from_numpy(X_in_test).float()
-                        y_in_train, y_in_test = torch.from_numpy(y_in_train).long(), torch.from_numpy(y_in_test).long()
-                        clf = MLP(self.classifier_config, inputdim=self.featdim,
-                                  nclasses=self.nclasses, l2reg=reg,
-                                  seed=self.seed)
-                        clf.fit(X_in_train, y_in_train,
-                                validation_data=(X_in_test, y_in_test))
-                        regscores.append(clf.score(X_in_test, y_in_test))
-                    else:
-                        clf = LogisticRegression(C=reg, random_state=self.seed)
-                        clf.fit(X_in_train, y_in_train)
-                        regscores.append(clf.score(X_in_test, y_in_test))
-                scores.append(round(100*np.mean(regscores), 2))
-            optreg = regs[np.argmax(scores)]
+            X_train, X_test = X[train_idx], X[test_idx]
+            y_train, y_test = y[train_idx], y[test_idx]
             logging.info('Best param found at split {0}: l2reg = {1} \
-                with score {2}'.format(count, optreg, np.max(scores)))
-            self.devresults.append(np.max(scores))
-
-            if self.usepytorch:
-                clf = MLP(self.classifier_config, inputdim=self.featdim,
-                          nclasses=self.nclasses, l2reg=optreg,
-                          seed=self.seed)
-                X_train = torch.from_numpy(X_train).float()
-                y_train = torch.from_numpy(y_train).long()
-                clf.fit(X_train, y_train, validation_split=0.05)
-
-                X_test = torch.from_numpy(X_test).float()
-                y_test = torch.from_numpy(y_test).long()
-            else:
-                clf = LogisticRegression(C=optreg, random_state=self.seed)
-                clf.fit(X_train, y_train)
+                with score {2}'.format(count, optreg, devscore))
+            self.devresults.append(devscore)
+
+            with profiling.phase('fit'):
+                if self.backend == 'ridge':
+                    clf = RidgeClassifier(self.nclasses, l2reg=optreg)
+                    clf.fit(X_train, y_train)
+                elif self.backend != 'sklearn':
+                    clf = fit_final(dict(self.config, classifier=params), self.featdim,
+                                    regs, optreg, X_train, y_train, folds=True,
+                                    validation_split=0.05)
+                else:
+                    clf = LogisticRegression(C=optreg, random_state=self.seed)
+                    clf.fit(X_train, y_train)
+                    profiling.count('fits')
 
-            test_score = clf.score(X_test, y_test)
-            self.testresults.append(round(100*test_score, 2))
+            with profiling.phase('score'):
+                test_score = clf.score(X_test, y_test)
+                self.testresults.append(round(100*test_score, 2))
+                self.correct.append(test_correct(clf, X_test, y_test))
 
+        # in the order of the rows of X
+        self.correct = np.concatenate(self.correct)[
+            np.argsort(np.concatenate([test_idx for _, test_idx in splits]))]
         devaccuracy = round(np.mean(self.devresults), 2)
         testaccuracy = round(np.mean(self.testresults), 2)
         return devaccuracy, testaccuracy
@@ -131,6 +448,9 @@ class KFoldClassifier(object):
         self.usepytorch = config['usepytorch']
         self.classifier_config = config['classifier']
         self.modelname = get_classif_name(self.classifier_config, self.usepytorch)
+        self.backend = get_backend(config)
+        self.search = get_search(config)
+        self.config = config
 
         self.k = 5 if 'kfold' not in config else config['kfold']
 
@@ -138,63 +458,53 @@ class KFoldClassifier(object):
         # cross-validation
         logging.info('Training {0} with {1}-fold cross-validation'
                      .format(self.modelname, self.k))
-        regs = [10**t for t in range(-5, -1)] if self.usepytorch else \
+        regs = [10**t for t in range(-5, -1)] if self.backend != 'sklearn' else \
                [2**t for t in range(-1, 6, 1)]
+        if self.backend == 'ridge':
+            regs = RIDGE_REGS
         skf = StratifiedKFold(n_splits=self.k, shuffle=True,
                               random_state=self.seed)
-        scores = []
-
-        for reg in regs:
-            scanscores = []
-            for train_idx, test_idx in skf.split(self.train['X'],
-                                                 self.train['y']):
-                # Split data
-                X_train, y_train = self.train['X'][train_idx], self.train['y'][train_idx]
-
-                X_test, y_test = self.train['X'][test_idx], self.train['y'][test_idx]
-
-                # Train classifier
-                if self.usepytorch:
-                    clf = MLP(self.classifier_config, inputdim=self.featdim,
-                              nclasses=self.nclasses, l2reg=reg,
-                              seed=self.seed)
-                    X_train, y_train = torch.from_numpy(X_train).float(), torch.from_numpy(y_train).long()
-                    X_test, y_test = torch.from_numpy(X_test).float(), torch.from_numpy(y_test).long()
-                    clf.fit(X_train, y_train, validation_data=(X_test, y_test))
-                else:
-                    clf = LogisticRegression(C=reg, random_state=self.seed)
-                    clf.fit(X_train, y_train)
-                score = clf.score(X_test, y_test)
-                scanscores.append(score)
-            # Append mean score
-            scores.append(round(100*np.mean(scanscores), 2))
-
-        # evaluation
-        logging.info([('reg:' + str(regs[idx]), scores[idx])
-                      for idx in range(len(scores))])
-        optreg = regs[np.argmax(scores)]
-        devaccuracy = np.max(scores)
+        X_train, y_train = as_tensors(self.config, self.train['X'], self.train['y'])
+        X_test, y_test = as_tensors(self.config, self.test['X'], self.test['y'])
+        folds = list(skf.split(self.train['X'], self.train['y']))
+        params = self.classifier_config
+        with profiling.phase('search'):
+            if self.search == 'halving':
+                params, optreg, devaccuracy = halving_search(
+                    self.config, self.featdim, regs,
+                    lambda: fold_splits(X_train, y_train, folds))
+                devaccuracy = round(100*devaccuracy, 2)
+            else:
+                scores = score_folds(self.config, self.featdim, regs,
+                                     X_train, y_train, folds)
+                scores = [round(100*score, 2) for score in scores.mean(0)]
+
+                # evaluation
+                logging.info([('reg:' + str(regs[idx]), scores[idx])
+                              for idx in range(len(scores))])
+                optreg = regs[np.argmax(scores)]
+                devaccuracy = np.max(scores)
         logging.info('Cross-validation : best param found is reg = {0} \
             with score {1}'.format(optreg, devaccuracy))
 
         logging.info('Evaluating...')
-        if self.usepytorch:
-            clf = MLP(self.classifier_config, inputdim=self.featdim,
-                      nclasses=self.nclasses, l2reg=optreg,
-                      seed=self.seed)
-
-            X_train, y_train = torch.from_numpy(self.train['X']).float(), torch.from_numpy(self.train['y']).long()
-            clf.fit(X_train, y_train, validation_split=0.05)
+        with profiling.phase('fit'):
+            if self.backend == 'ridge':
+                clf = RidgeClassifier(self.nclasses, l2reg=optreg)
+                clf.fit(X_train, y_train)
+            elif self.backend != 'sklearn':
+                clf = fit_final(dict(self.config, classifier=params), self.featdim,
+                                regs, optreg, X_train, y_train, folds=True,
+                                validation_split=0.05)
+            else:
+                clf = LogisticRegression(C=optreg, random_state=self.seed)
+                clf.fit(X_train, y_train)
+                profiling.count('fits')
 
-            X_test = torch.from_numpy(self.test['X']).float()
-            y_test = torch.from_numpy(self.test['y']).long()
+        with profiling.phase('score'):
             testaccuracy = clf.score(X_test, y_test)
-        else:
-            clf = LogisticRegression(C=optreg, random_state=self.seed)
-            clf.fit(self.train['X'], self.train['y'])
-            testaccuracy = clf.score(self.test['X'], self.test['y'])
-
-        yhat = clf.predict(X_test)
+            yhat = clf.predict(X_test)
+        self.correct = np.asarray(yhat).ravel() == np.asarray(y_test)
         testaccuracy = round(100*testaccuracy, 2)
 
         return devaccuracy, testaccuracy, yhat
@@ -215,65 +525,61 @@ class SplitClassifier(object):
         self.device = 'cpu' if 'device' not in config else config['device']
         self.modelname = get_classif_name(self.classifier_config, self.usepytorch)
         self.noreg = False if 'noreg' not in config else config['noreg']
+        self.backend = get_backend(config)
+        self.search = get_search(config)
         self.config = config
 
     def run(self):
         logging.info('Training {0} with standard validation..'
                      .format(self.modelname))
-        regs = [10**t for t in range(-5, -1)] if self.usepytorch else \
+        regs = [10**t for t in range(-5, -1)] if self.backend != 'sklearn' else \
                [2**t for t in range(-2, 4, 1)]
+        if self.backend == 'ridge':
+            regs = RIDGE_REGS
         if self.noreg:
-            regs = [1e-9 if self.usepytorch else 1e9]
-        scores = []
-        for reg in regs:
-            if self.usepytorch:
-                clf = MLP(self.classifier_config, inputdim=self.featdim,
-                          nclasses=self.nclasses, l2reg=reg,
-                          seed=self.seed, device=self.device)
-
-                # TODO: Find a hack for reducing nb epoches in SNLI
-                X_train = torch.from_numpy(self.X['train']).float()
-                y_train = torch.from_numpy(self.y['train']).long()
-                X_val = torch.from_numpy(self.X['valid']).float()
-                y_val = torch.from_numpy(self.y['valid']).long()
-                clf.fit(X_train, y_train,
-                        validation_data=(X_val, y_val))
-
+            regs = [1e9 if self.backend == 'sklearn' else 1e-9]
+        X, y = {}, {}
+        for split in ['train', 'valid', 'test']:
+            X[split], y[split] = as_tensors(self.config, self.X[split],
+                                            self.y[split], self.device)
+        params = self.classifier_config
+        with profiling.phase('search'):
+            if self.search == 'halving':
+                params, optreg, devaccuracy = halving_search(
+                    self.config, self.featdim, regs,
+                    lambda: [(X['train'], y['train'], X['valid'], y['valid'])],
+                    device=self.device)
+                devaccuracy = round(100*devaccuracy, 2)
             else:
-                clf = LogisticRegression(C=reg, random_state=self.seed)
-                clf.fit(self.X['train'], self.y['train'])
-                X_val, y_val = self.X['valid'], self.y['valid']
-            scores.append(round(100*clf.score(X_val,
-                                y_val), 2))
-        logging.info([('reg:'+str(regs[idx]), scores[idx])
-                      for idx in range(len(scores))])
-        optreg = regs[np.argmax(scores)]
-        devaccuracy = np.max(scores)
+                scores = score_regs(self.config, self.featdim, regs,
+                                    X['train'], y['train'], X['valid'], y['valid'],
+                                    device=self.device)
+                scores = [round(100*score, 2) for score in scores]
+                logging.info([('reg:'+str(regs[idx]), scores[idx])
+                              for idx in range(len(scores))])
+                optreg = regs[np.argmax(scores)]
+                devaccuracy = np.max(scores)
         logging.info('Validation : best param found is reg = {0} with score \
             {1}'.format(optreg, devaccuracy))
 
         logging.info('Evaluating...')
-        if self.usepytorch:
-            clf = MLP(self.classifier_config, inputdim=self.featdim,
-                      nclasses=self.nclasses, l2reg=optreg,
-                      seed=self.seed, device=self.device)
-
-            # TODO: Find a hack for reducing nb epoches in SNLI
-            X_train = torch.from_numpy(self.X['train']).float()
-            y_train = torch.from_numpy(self.y['train']).long()
-            X_val = torch.from_numpy(self.X['valid']).float()
-            y_val = torch.from_numpy(self.y['valid']).long()
-            clf.fit(X_train, y_train,
-                    validation_data=(X_val, y_val))
-
-            X_test = torch.from_numpy(self.X['test']).float()
-            y_test = torch.from_numpy(self.y['test']).long()
-        else:
-            clf = LogisticRegression(C=optreg, random_state=self.seed)
-            clf.fit(self.X['train'], self.y['train'])
-            X_test = self.X['test']
-            y_test = self.y['test']
-
-        testaccuracy = clf.score(X_test, y_test)
+        with profiling.phase('fit'):
+            if self.backend == 'ridge':
+                clf = RidgeClassifier(self.nclasses, l2reg=optreg,
+                                      device=self.device)
+                clf.fit(X['train'], y['train'])
+            elif self.backend != 'sklearn':
+                # TODO: Find a hack for reducing nb epoches in SNLI
+                clf = fit_final(dict(self.config, classifier=params), self.featdim,
+                                regs, optreg, X['train'], y['train'], device=self.device,
+                                validation_data=(X['valid'], y['valid']))
+            else:
+                clf = LogisticRegression(C=optreg, random_state=self.seed)
+                clf.fit(X['train'], y['train'])
+                profiling.count('fits')
+
+        with profiling.phase('score'):
+            testaccuracy = clf.score(X['test'], y['test'])
+            self.correct = test_correct(clf, X['test'], y['test'])
         testaccuracy = round(100*testaccuracy, 2)
         return devaccuracy, testaccuracy
@@ -16,6 +16,7 @@ import io
 import logging
 import numpy as np
 
+from senteval import utils
 from senteval.tools.validation import KFoldClassifier
 
 
@@ -44,8 +45,10 @@ class TRECEval(object):
         return trec_data
 
     def run(self, params, batcher):
-        train_embeddings, test_embeddings = [], []
+        self.encode(params, batcher)
+        return self.evaluate(params)
 
+    def encode(self, params, batcher):
         # Sort to reduce padding
         sorted_corpus_train = sorted(zip(self.train['X'], self.train['y']),
                                      key=lambda z: (len(z[0]), z[1]))
@@ -58,32 +61,30 @@ class TRECEval(object):
         test_labels = [y for (x, y) in sorted_corpus_test]
 
         # Get train embeddings
-        for ii in range(0, len(train_labels), params.batch_size):
-            batch = train_samples[ii:ii + params.batch_size]
-            embeddings = batcher(params, batch)
-            train_embeddings.append(embeddings)
-        train_embeddings = np.vstack(train_embeddings)
+        train_embeddings = utils.batch_encode(params, batcher, train_samples)
         logging.info('Computed train embeddings')
 
         # Get test embeddings
-        for ii in range(0, len(test_labels), params.batch_size):
-            batch = test_samples[ii:ii + params.batch_size]
-            embeddings = batcher(params, batch)
-            test_embeddings.append(embeddings)
-        test_embeddings = np.vstack(test_embeddings)
+        test_embeddings = utils.batch_encode(params, batcher, test_samples)
         logging.info('Computed test embeddings')
+        self.trec_embed = {'train': {'X': train_embeddings,
+                                     'y': np.array(train_labels)},
+                           'test': {'X': test_embeddings,
+                                    'y': np.array(test_labels)}}
 
+    def evaluate(self, params):
         config_classifier = {'nclasses': 6, 'seed': self.seed,
                              'usepytorch': params.usepytorch,
                              'classifier': params.classifier,
                              'kfold': params.kfold}
-        clf = KFoldClassifier({'X': train_embeddings,
-                               'y': np.array(train_labels)},
-                              {'X': test_embeddings,
-                               'y': np.array(test_labels)},
+        clf = KFoldClassifier(self.trec_embed['train'],
+                              self.trec_embed['test'],
                               config_classifier)
         devacc, testacc, _ = clf.run()
         logging.debug('\nDev acc : {0} Test acc : {1} \
             for TREC\n'.format(devacc, testacc))
-        return {'devacc': devacc, 'acc': testacc,
-                'ndev': len(self.train['X']), 'ntest': len(self.test['X'])}
+        results = {'devacc': devacc, 'acc': testacc,
+                   'ndev': len(self.train['X']), 'ntest': len(self.test['X'])}
+        if params.per_example:
+            results['correct'] = clf.correct
+        return results
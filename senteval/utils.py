@@ -10,7 +10,15 @@ from __future__ import absolute_import, division, unicode_literals
 import numpy as np
 import re
 import inspect
-from torch import optim
+import tempfile
+import threading
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from senteval import profiling
 
 
 def create_dictionary(sentences):
@@ -39,6 +47,348 @@ def cosine(u, v):
     return np.dot(u, v) / (np.linalg.norm(u) * np.linalg.norm(v))
 
 
+# similarities of the rows of E1 and E2 (n x dim), NaN embeddings and scores
+# are set to zero as in the default per-pair cosine of the STS tasks
+def cosine_similarity(E1, E2):
+    E1, E2 = np.nan_to_num(E1), np.nan_to_num(E2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.einsum('ij,ij->i', E1, E2) / \
+            (np.linalg.norm(E1, axis=1) * np.linalg.norm(E2, axis=1))
+    return np.nan_to_num(scores)
+
+
+def dot_similarity(E1, E2):
+    return np.einsum('ij,ij->i', np.nan_to_num(E1), np.nan_to_num(E2))
+
+
+def l1_similarity(E1, E2):
+    return -np.abs(np.nan_to_num(E1) - np.nan_to_num(E2)).sum(1)
+
+
+def l2_similarity(E1, E2):
+    return -np.linalg.norm(np.nan_to_num(E1) - np.nan_to_num(E2), axis=1)
+
+
+def angular_similarity(E1, E2):
+    return 1 - np.arccos(np.clip(cosine_similarity(E1, E2), -1, 1)) / np.pi
+
+
+BATCH_SIMILARITIES = {'cosine': cosine_similarity, 'dot': dot_similarity,
+                      'l1': l1_similarity, 'l2': l2_similarity,
+                      'angular': angular_similarity}
+
+
+def get_batch_similarity(similarity):
+    # built-in similarity name or callable(E1, E2) -> scores
+    if callable(similarity):
+        return similarity
+    assert similarity in BATCH_SIMILARITIES, 'Unknown similarity ' + str(similarity)
+    return BATCH_SIMILARITIES[similarity]
+
+
+def resample_counts(idx, n):
+    # number of occurrences of each of n values in each row of idx
+    rows = n * np.arange(len(idx))[:, None]
+    return np.bincount((idx + rows).ravel(),
+                       minlength=len(idx) * n).reshape(len(idx), n)
+
+
+def bootstrap_correlations(x, y, n_resamples, seed=1111, max_size=2**22):
+    """
+    Pearson and Spearman correlations of x and y on n_resamples bootstrap
+    resamples of the pairs, drawn as an index matrix and processed in blocks
+    of at most max_size indices. Correlations are computed from the counts
+    of each pair in the resamples, and ranks from the counts of smaller and
+    equal values, so that no resample is gathered or sorted.
+    Returns two arrays of n_resamples correlations.
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    x, y = x - x.mean(), y - y.mean()
+    n = len(x)
+    # groups of equal values, in increasing order
+    x_values, x_groups = np.unique(x, return_inverse=True)
+    y_values, y_groups = np.unique(y, return_inverse=True)
+    x_groups, y_groups = x_groups.ravel(), y_groups.ravel()
+    # resamples have n values, their mean rank is (n + 1) / 2
+    mean_rank = (n + 1) / 2
+
+    rng = np.random.RandomState(seed)
+    block = max(1, max_size // n)
+    pearsons, spearmans = [], []
+    for start in range(0, n_resamples, block):
+        idx = rng.randint(0, n, size=(min(block, n_resamples - start), n))
+        C = resample_counts(idx, n).astype(np.float64)
+        sx, sy = C.dot(x), C.dot(y)
+        cov = C.dot(x * y) - sx * sy / n
+        var_x, var_y = C.dot(x * x) - sx ** 2 / n, C.dot(y * y) - sy ** 2 / n
+
+        # average rank of each group of values within each resample
+        Gx = resample_counts(x_groups[idx], len(x_values))
+        Gy = resample_counts(y_groups[idx], len(y_values))
+        Rx = np.cumsum(Gx, 1) - (Gx - 1) / 2 - mean_rank
+        Ry = np.cumsum(Gy, 1) - (Gy - 1) / 2 - mean_rank
+        rank_cov = np.einsum('ij,ij,ij->i', C, Rx[:, x_groups], Ry[:, y_groups])
+        rank_var_x = np.einsum('ij,ij,ij->i', Gx, Rx, Rx)
+        rank_var_y = np.einsum('ij,ij,ij->i', Gy, Ry, Ry)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pearsons.append(cov / np.sqrt(var_x * var_y))
+            spearmans.append(rank_cov / np.sqrt(rank_var_x * rank_var_y))
+    return np.concatenate(pearsons), np.concatenate(spearmans)
+
+
+def paired_accuracy_deltas(correct_a, correct_b, test, n_resamples, seed=1111,
+                           max_size=2**22):
+    """
+    Differences of accuracy between systems a and b (per-example correctness
+    correct_a and correct_b) on n_resamples paired bootstrap resamples of the
+    examples, or on n_resamples random swaps of their outputs (permutation).
+    """
+    d = np.asarray(correct_a, dtype=np.float64) - np.asarray(correct_b, dtype=np.float64)
+    n = len(d)
+    rng = np.random.RandomState(seed)
+    block = max(1, max_size // n)
+    deltas = []
+    for start in range(0, n_resamples, block):
+        size = min(block, n_resamples - start)
+        if test == 'bootstrap':
+            M = resample_counts(rng.randint(0, n, size=(size, n)), n)
+        else:  # swapping the outputs of an example flips the sign of d
+            M = 2 * rng.randint(0, 2, size=(size, n)) - 1
+        deltas.append(M.dot(d) / n)
+    return np.concatenate(deltas)
+
+
+def paired_correlation_deltas(scores_a, scores_b, gold, test, n_resamples,
+                              seed=1111, max_size=2**22):
+    """
+    Differences of Pearson correlation with gold between the scores of
+    systems a and b, on n_resamples paired bootstrap resamples of the pairs
+    or on n_resamples random swaps of their (standardized) scores.
+    """
+    if test == 'bootstrap':
+        # same seed and size, hence the same resamples for both systems
+        pearsons_a, _ = bootstrap_correlations(scores_a, gold, n_resamples, seed, max_size)
+        pearsons_b, _ = bootstrap_correlations(scores_b, gold, n_resamples, seed, max_size)
+        return pearsons_a - pearsons_b
+
+    # Pearson correlations are invariant to the scale of each system
+    za, zb = [(s - np.mean(s)) / np.std(s) for s in
+              [np.asarray(scores_a, dtype=np.float64), np.asarray(scores_b, dtype=np.float64)]]
+    g = np.asarray(gold, dtype=np.float64)
+    g = (g - g.mean()) / np.linalg.norm(g - g.mean())
+    n = len(g)
+    rng = np.random.RandomState(seed)
+    block = max(1, max_size // n)
+    deltas = []
+    for start in range(0, n_resamples, block):
+        swap = rng.randint(0, 2, size=(min(block, n_resamples - start), n)).astype(bool)
+        Xa, Xb = np.where(swap, zb, za), np.where(swap, za, zb)
+        Xa -= Xa.mean(1, keepdims=True)
+        Xb -= Xb.mean(1, keepdims=True)
+        deltas.append(Xa.dot(g) / np.linalg.norm(Xa, axis=1) -
+                      Xb.dot(g) / np.linalg.norm(Xb, axis=1))
+    return np.concatenate(deltas)
+
+
+def paired_pvalue(deltas, observed, test):
+    # two-sided p-value of the observed difference between two systems, with
+    # the add-one estimate so that it is never 0 with a finite number of
+    # resamples
+    if test == 'bootstrap':
+        count = min(np.sum(deltas <= 0), np.sum(deltas >= 0))
+        return min(1., 2 * (count + 1) / (len(deltas) + 1))
+    return (np.sum(np.abs(deltas) >= abs(observed) - 1e-12) + 1) / (len(deltas) + 1)
+
+
+def confidence_interval(samples, level=0.95):
+    # percentile interval of bootstrap samples, resamples with undefined
+    # (constant) correlations are ignored
+    lower = 100 * (1 - level) / 2
+    return tuple(np.nanpercentile(samples, [lower, 100 - lower]))
+
+
+def get_batches(params, lengths):
+    """
+    Split sentences sorted by length into batches of consecutive sentences,
+    yields (start, end) indices. Batches have params.batch_size sentences, or
+    if params.max_tokens is set, as many sentences as fit in a budget of
+    max_tokens padded tokens (at most params.max_batch_size sentences).
+    """
+    if not params.max_tokens:
+        for ii in range(0, len(lengths), params.batch_size):
+            yield ii, min(ii + params.batch_size, len(lengths))
+        return
+
+    max_batch_size = params.max_batch_size or len(lengths)
+    start = 0
+    for end in range(1, len(lengths) + 1):
+        # padded size of the batch if sentence [end] was added
+        if end == len(lengths) or end - start == max_batch_size or \
+                (end - start + 1) * max(lengths[end], 1) > params.max_tokens:
+            yield start, end
+            start = end
+
+
+class EmbeddingCollector(object):
+    """
+    float32 embedding matrix of n sentences, allocated when the first batch
+    reveals the embedding dimension and filled in place. The matrix is a
+    memory map on a temporary file of memmap_dir if given.
+    """
+    def __init__(self, n, memmap_dir=None):
+        self.n = n
+        self.memmap_dir = memmap_dir
+        self.embeddings = None
+
+    def write(self, idx, embeddings):
+        if self.embeddings is None:
+            shape = (self.n, embeddings.shape[1])
+            if self.memmap_dir is None:
+                self.embeddings = np.empty(shape, dtype=np.float32)
+            else:
+                self.embeddings = np.memmap(tempfile.TemporaryFile(dir=self.memmap_dir),
+                                            dtype=np.float32, mode='w+', shape=shape)
+        self.embeddings[idx] = embeddings
+
+    def result(self):
+        if self.embeddings is None:
+            return np.zeros((self.n, 0), dtype=np.float32)
+        return self.embeddings
+
+
+def sorted_batches(params, samples):
+    """
+    Sort samples by length and split them with get_batches, yields
+    (indices of the batch in samples, batch).
+    """
+    lengths = [len(s) for s in samples]
+    order = np.argsort(lengths, kind='stable')
+    for start, end in get_batches(params, [lengths[i] for i in order]):
+        yield order[start:end], [samples[i] for i in order[start:end]]
+
+
+def batch_encode(params, batcher, samples):
+    """
+    Encode samples with batcher, in batches of sentences of similar length.
+    Returns the embeddings in the order of samples.
+    """
+    if hasattr(batcher, 'batch_encode'):
+        return batcher.batch_encode(params, samples)
+
+    enc_input = EmbeddingCollector(len(samples), params.memmap_dir)
+    for idx, batch in sorted_batches(params, samples):
+        with profiling.phase('batcher'):
+            embeddings = batcher(params, batch)
+        enc_input.write(idx, embeddings)
+    profiling.count('sentences', len(samples))
+    return enc_input.result()
+
+
+def prefetch(iterable, size=1):
+    """
+    Iterate over iterable in a background thread which runs at most size
+    items ahead of the consumer : the next item is only produced once the
+    consumer is done with (has asked for the item after) all but size of the
+    previous ones, so that at most size + 1 items are alive at once.
+    """
+    queue = Queue()
+    slots = threading.Semaphore(size + 1)
+    stop = threading.Event()
+    done = object()
+
+    def acquire():
+        while not stop.is_set():
+            if slots.acquire(timeout=0.1):
+                return True
+        return False
+
+    def produce():
+        try:
+            iterator = iter(iterable)
+            while acquire():
+                item = next(iterator, done)
+                queue.put((item, None))
+                if item is done:
+                    return
+                # no reference is kept while waiting for a slot
+                item = None
+        except BaseException as e:
+            queue.put((done, e))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+            item = None
+            slots.release()
+    finally:
+        stop.set()
+
+
+class Checkpoint(object):
+    """
+    Copy of the state_dict of a torch model, kept in buffers allocated on
+    the first save and overwritten in place by the next ones.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.state = None
+
+    def save(self):
+        state = self.model.state_dict()
+        if self.state is None:
+            self.state = {k: v.detach().clone() for k, v in state.items()}
+        else:
+            for k, v in state.items():
+                self.state[k].copy_(v)
+
+    def restore(self):
+        self.model.load_state_dict(self.state)
+
+
+class EpochIterator(object):
+    """
+    Minibatches of a random permutation (torch.randperm) of the rows of
+    tensors, yielded as (indices, batch of each tensor). Permuted rows are
+    gathered with index_select into buffers of at most max_bytes allocated
+    once, batches are contiguous views of these buffers (moved to device).
+    """
+    def __init__(self, tensors, batch_size, device=None, max_bytes=2**28):
+        self.tensors = tensors
+        self.batch_size = batch_size
+        self.device = device
+        self.permutation = None
+        nrows = len(tensors[0])
+        row_bytes = sum(t[0].numel() * t.element_size() for t in tensors)
+        chunk = max(1, max_bytes // (max(row_bytes, 1) * batch_size)) * batch_size
+        chunk = min(chunk, nrows)
+        self.buffers = [t.new_empty((chunk,) + t.shape[1:]) for t in tensors]
+
+    def __iter__(self):
+        import torch
+
+        nrows = len(self.tensors[0])
+        self.permutation = torch.randperm(nrows, device=self.tensors[0].device)
+        chunk = len(self.buffers[0])
+        for start in range(0, nrows, chunk):
+            idx = self.permutation[start:start + chunk]
+            buffers = [torch.index_select(t, 0, idx, out=b[:len(idx)])
+                       for t, b in zip(self.tensors, self.buffers)]
+            for i in range(0, len(idx), self.batch_size):
+                batch = [b[i:i + self.batch_size] for b in buffers]
+                if self.device is not None:
+                    batch = [b.to(self.device) for b in batch]
+                yield [idx[i:i + self.batch_size]] + batch
+
+
 class dotdict(dict):
     """ dot.notation access to dictionary attributes """
     __getattr__ = dict.get
@@ -46,6 +396,17 @@ class dotdict(dict):
     __delattr__ = dict.__delitem__
 
 
+def limit_threads(nthreads):
+    # thread pools of torch and (with threadpoolctl) of numpy BLAS
+    import torch
+    torch.set_num_threads(nthreads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(nthreads)
+    except ImportError:
+        pass
+
+
 def get_optimizer(s):
     """
     Parse optimizer parameters.
@@ -53,6 +414,8 @@ def get_optimizer(s):
         - "sgd,lr=0.01"
         - "adagrad,lr=0.1,lr_decay=0.05"
     """
+    from torch import optim
+
     if "," in s:
         method = s[:s.find(',')]
         optim_params = {}
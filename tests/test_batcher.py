@@ -0,0 +1,107 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+"""
+AsyncBatcher against the stand-in server of examples/remote.py
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import socket
+import asyncio
+import importlib.util
+import numpy as np
+import pytest
+
+from senteval import utils
+from senteval.batcher import AsyncBatcher
+
+PATH_TO_REMOTE = os.path.join(os.path.dirname(__file__), '..', 'examples', 'remote.py')
+
+
+@pytest.fixture(scope='module')
+def remote():
+    spec = importlib.util.spec_from_file_location('remote', PATH_TO_REMOTE)
+    remote = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(remote)
+    # any free port
+    sock = socket.socket()
+    sock.bind((remote.HOST, 0))
+    remote.PORT = sock.getsockname()[1]
+    sock.close()
+    remote.LATENCY = 0.01
+    server = remote.start_server()
+    yield remote
+    server.close()
+
+
+def get_params(max_concurrency):
+    return utils.dotdict({'batch_size': 4, 'max_concurrency': max_concurrency})
+
+
+def get_samples():
+    words = ['a', 'cat', 'sat', 'on', 'the', 'mat', 'with', 'dog']
+    rng = np.random.RandomState(0)
+    return [list(rng.choice(words, size=rng.randint(1, 8))) for _ in range(50)]
+
+
+def expected(remote, samples):
+    return np.array([np.mean([remote.word_vector(w) for w in sent], 0)
+                     for sent in samples])
+
+
+def test_encode_concurrent(remote):
+    samples = get_samples()
+    batcher = AsyncBatcher(remote.batcher)
+    for max_concurrency in [1, 8]:
+        embeddings = batcher.batch_encode(get_params(max_concurrency), samples)
+        assert embeddings.shape == (len(samples), remote.DIM)
+        np.testing.assert_allclose(embeddings, expected(remote, samples), rtol=1e-5)
+
+
+def test_encode_failure_cancels_workers(remote):
+    samples = get_samples()
+
+    async def failing(params, batch):
+        if len(batch[0]) > 4:
+            raise RuntimeError('encoder failure')
+        return await remote.batcher(params, batch)
+
+    batcher = AsyncBatcher(failing)
+    with pytest.raises(RuntimeError, match='encoder failure'):
+        batcher.batch_encode(get_params(8), samples)
+    # no worker is left pending on the loop
+    assert not [task for task in asyncio.all_tasks(batcher.loop) if not task.done()]
+
+    # the loop is reused by the next call
+    batcher.batcher = remote.batcher
+    embeddings = batcher.batch_encode(get_params(8), samples)
+    np.testing.assert_allclose(embeddings, expected(remote, samples), rtol=1e-5)
+
+
+def test_encode_checks_batch_length(remote):
+    async def truncating(params, batch):
+        return (await remote.batcher(params, batch))[:-1]
+
+    batcher = AsyncBatcher(truncating)
+    with pytest.raises(AssertionError, match='embeddings for a batch'):
+        batcher.batch_encode(get_params(2), get_samples())
+
+
+def test_close(remote):
+    samples = get_samples()
+    with AsyncBatcher(remote.batcher) as batcher:
+        batcher.batch_encode(get_params(4), samples)
+        loop = batcher.loop
+        # a task left on the loop is cancelled
+        task = loop.create_task(asyncio.sleep(60))
+    assert loop.is_closed() and task.cancelled()
+
+    # a new loop is created by the next call
+    embeddings = batcher.batch_encode(get_params(4), samples)
+    np.testing.assert_allclose(embeddings, expected(remote, samples), rtol=1e-5)
+    batcher.close()
@@ -0,0 +1,49 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+"""
+Bootstrap confidence intervals of correlations
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+import pytest
+from scipy.stats import pearsonr, spearmanr
+
+from senteval import utils
+
+
+def correlated(n=200, rho=0.6, seed=0):
+    rng = np.random.RandomState(seed)
+    x = rng.randn(n)
+    y = rho * x + np.sqrt(1 - rho ** 2) * rng.randn(n)
+    # ties, as in the discrete gold scores of STS
+    return x, np.round(2 * y) / 2
+
+
+def test_confidence_interval_contains_estimate():
+    x, y = correlated()
+    pearsons, spearmans = utils.bootstrap_correlations(x, y, 1000)
+    for samples, estimate in [(pearsons, pearsonr(x, y)[0]),
+                              (spearmans, spearmanr(x, y)[0])]:
+        lower, upper = utils.confidence_interval(samples)
+        assert lower < estimate < upper
+        assert upper - lower < 0.3
+
+
+@pytest.mark.parametrize('max_size', [2**22, 1000])
+def test_matches_naive_resampling(max_size):
+    # the same resamples, drawn in one matrix, gathered and correlated one by one
+    x, y = correlated(n=50)
+    n_resamples = 100
+    pearsons, spearmans = utils.bootstrap_correlations(x, y, n_resamples, seed=7,
+                                                       max_size=max_size)
+    idx = np.random.RandomState(7).randint(0, len(x), size=(n_resamples, len(x)))
+    np.testing.assert_allclose(pearsons, [pearsonr(x[i], y[i])[0] for i in idx],
+                               atol=1e-10)
+    np.testing.assert_allclose(spearmans, [spearmanr(x[i], y[i])[0] for i in idx],
+                               atol=1e-10)
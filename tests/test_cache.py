@@ -0,0 +1,88 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+"""
+On-disk embedding cache and in-memory embedding table
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+
+from senteval import utils
+from senteval.cache import EmbeddingCache, CachedBatcher, EmbeddingTable, \
+    sentence_key
+
+
+class CountingBatcher(object):
+    # deterministic embeddings of each sentence, counting calls and sentences
+    def __init__(self):
+        self.calls, self.sentences = 0, 0
+
+    def __call__(self, params, batch):
+        self.calls += 1
+        self.sentences += len(batch)
+        return np.array([[len(s), sum(len(w) for w in s),
+                          sum(ord(c) * (i + 1) for i, w in enumerate(s) for c in w)]
+                         for s in batch], dtype=np.float32)
+
+
+def get_params():
+    return utils.dotdict({'batch_size': 4})
+
+
+def get_samples(n, offset=0):
+    return [['sentence', str(i), 'x' * (i % 5)] for i in range(offset, offset + n)]
+
+
+def test_warm_rerun_does_not_call_batcher(tmp_path):
+    samples = get_samples(30)
+    batcher = CountingBatcher()
+    cache = EmbeddingCache(str(tmp_path), 'encoder', shard_size=8)
+    cold = utils.batch_encode(get_params(), CachedBatcher(batcher, cache), samples)
+    cache.flush()
+    assert batcher.sentences == len(samples)
+
+    batcher = CountingBatcher()
+    cache = EmbeddingCache(str(tmp_path), 'encoder', shard_size=8)
+    warm = utils.batch_encode(get_params(), CachedBatcher(batcher, cache), samples)
+    assert batcher.calls == 0
+    assert cache.hits == len(samples) and cache.misses == 0
+    np.testing.assert_array_equal(cold, warm)
+
+
+def test_shared_directory_merges_indexes(tmp_path):
+    # both caches are opened before either writes its index
+    samples_a, samples_b = get_samples(20), get_samples(20, offset=15)
+    cache_a = EmbeddingCache(str(tmp_path), 'encoder', shard_size=8)
+    cache_b = EmbeddingCache(str(tmp_path), 'encoder', shard_size=8)
+    encoded_a = utils.batch_encode(get_params(), CachedBatcher(CountingBatcher(), cache_a),
+                                   samples_a)
+    encoded_b = utils.batch_encode(get_params(), CachedBatcher(CountingBatcher(), cache_b),
+                                   samples_b)
+    cache_a.flush()
+    cache_b.flush()
+
+    batcher = CountingBatcher()
+    cache = EmbeddingCache(str(tmp_path), 'encoder')
+    samples = samples_a + samples_b
+    merged = utils.batch_encode(get_params(), CachedBatcher(batcher, cache), samples)
+    assert batcher.calls == 0
+    assert len(cache.entries) == len(set(sentence_key(s) for s in samples))
+    np.testing.assert_array_equal(merged, np.vstack([encoded_a, encoded_b]))
+
+
+def test_keys_do_not_collide():
+    assert sentence_key(['a b']) != sentence_key(['a', 'b'])
+    assert sentence_key([b'a', b'b']) == sentence_key(['a', 'b'])
+
+    samples = [['a b'], ['a', 'b'], ['a', 'b']]
+    table = EmbeddingTable(samples)
+    table.encode(get_params(), CountingBatcher())
+    assert len(table.samples) == 2
+    embeddings = table(get_params(), samples)
+    assert not np.array_equal(embeddings[0], embeddings[1])
+    np.testing.assert_array_equal(embeddings[1], embeddings[2])
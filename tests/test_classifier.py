@@ -0,0 +1,62 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+"""
+Pytorch classifiers and closed-form ridge classifier
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+import pytest
+import torch
+from sklearn.linear_model import RidgeClassifier as SklearnRidge
+
+from senteval.tools.classifier import MLP, BatchedMLP, RidgeClassifier
+
+
+def toy_problem(n_train=300, n_dev=100, dim=10, nclasses=3, seed=0):
+    rng = np.random.RandomState(seed)
+    w = rng.randn(dim, nclasses)
+    X = rng.randn(n_train + n_dev, dim).astype(np.float32)
+    y = (X @ w + rng.randn(n_train + n_dev, nclasses)).argmax(1)
+    X, y = torch.from_numpy(X), torch.from_numpy(y)
+    return X[:n_train], y[:n_train], X[n_train:], y[n_train:]
+
+
+@pytest.mark.parametrize('nhid', [0, 8])
+def test_batched_mlp_matches_separate_fits(nhid):
+    X, y, X_dev, y_dev = toy_problem()
+    params = {'nhid': nhid, 'optim': 'adam', 'tenacity': 2, 'epoch_size': 2,
+              'max_epoch': 20, 'batch_size': 32}
+    regs = [1e-4, 1e-2, 1.]
+    batched = BatchedMLP(params, inputdim=10, nclasses=3, l2regs=regs, seed=1111)
+    devacc = batched.fit(X, y, validation_data=(X_dev, y_dev))
+
+    for i, reg in enumerate(regs):
+        clf = MLP(params, inputdim=10, nclasses=3, l2reg=reg, seed=1111)
+        assert clf.fit(X, y, validation_data=(X_dev, y_dev)) == devacc[i]
+        linears = [m for m in clf.model if isinstance(m, torch.nn.Linear)]
+        stacked = list(batched.model.parameters())
+        for linear, weight, bias in zip(linears, stacked[::2], stacked[1::2]):
+            np.testing.assert_allclose(weight[i].detach().numpy(),
+                                       linear.weight.detach().numpy().T, atol=1e-4)
+            np.testing.assert_allclose(bias[i, 0].detach().numpy(),
+                                       linear.bias.detach().numpy(), atol=1e-4)
+
+
+@pytest.mark.parametrize('l2reg', [1e-3, 1., 10.])
+def test_ridge_matches_sklearn(l2reg):
+    X, y, X_dev, _ = toy_problem()
+    clf = RidgeClassifier(nclasses=3, l2reg=l2reg).fit(X, y)
+    # l2reg is relative to the mean eigenvalue of the centered X^T X
+    X_centered = X.numpy().astype(np.float64) - X.numpy().mean(0)
+    alpha = l2reg * np.trace(X_centered.T @ X_centered) / X.shape[1]
+    reference = SklearnRidge(alpha=alpha).fit(X.numpy(), y.numpy())
+
+    np.testing.assert_allclose(clf.coef.numpy(), reference.coef_.T, rtol=1e-3, atol=1e-5)
+    np.testing.assert_allclose(clf.intercept.numpy(), reference.intercept_, rtol=1e-3, atol=1e-5)
+    np.testing.assert_array_equal(clf.predict(X_dev), reference.predict(X_dev.numpy()))